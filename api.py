@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Local HTTP JSON API with the satisfaction aggregates of the dashboard,
+# for other university systems.
+#
+#   python api.py --port 8502
+#
+#   GET /perfis                                   profiles and their years
+#   GET /indice?perfil=Estudantes&ano=2024        index per item
+#   GET /percentual?perfil=Estudantes&ano=2024    answer percentages per item
+#   GET /comparacao?perfil=Estudantes[&ano=2021&ano=2024]
+#                                                 index per year and item
+#
+# Filters are further parameters named after the facets, OR within a facet
+# and AND across them: ...&Campus=UFJF - Campus Juiz de Fora&Perfil=...
+# Responses carry a content-hash ETag and are kept in a results.ResultCache
+# keyed by the request and the stamps of its source files; a request with
+# a matching If-None-Match is answered 304.
+import os
+import json
+import hashlib
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ingestion import FACETS, PERFIS, data_path, listar_anos, load_questions, load_years
+from satisfaction import SatisfactionEngine
+from significance import year_changes
+from filters import FilterIndex, suppress_single
+from cube import load_cube
+from results import BUDGET, ResultCache, data_version, selection_key
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _records(df):
+    # Rows as dicts, NaN as null
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+def _questions(perfil, pasta_dados):
+    Q = load_questions(perfil, pasta_dados).drop_duplicates('subquestions').set_index('subquestions')
+    return Q['text'], Q['question_data']
+
+def _selection(params):
+    # Facet filters of the query; any other parameter is an error
+    unknown = set(params) - set(FACETS) - {'perfil', 'ano'}
+    if unknown:
+        raise ApiError(400, f'parâmetros desconhecidos: {", ".join(sorted(unknown))}')
+    return {f: sorted(params[f]) for f in FACETS if f in params}
+
+def _perfil_ano(params, pasta_dados):
+    perfil = params.get('perfil', [None])[0]
+    ano = params.get('ano', [None])[0]
+    if perfil is None or ano is None:
+        raise ApiError(400, 'informe perfil e ano')
+    # Both are checked against the known values before reaching a path
+    if perfil not in PERFIS:
+        raise ApiError(404, 'informe um perfil válido')
+    if ano not in profiles(pasta_dados)[perfil]:
+        raise ApiError(404, f'sem dados de {perfil} em {ano}')
+    return perfil, ano
+
+def _cells(cube, selection):
+    cells = cube.select({d: v for d, v in selection.items() if d in cube.dims})
+    if any(d not in cube.dims for d in selection):
+        cells[:] = False
+    respondentes = suppress_single(int(cube.respondents[cells].sum()))
+    if not respondentes:
+        cells[:] = False
+    return cells, respondentes
+
+
+def profiles(pasta_dados='data'):
+    return {perfil: [ano for ano in listar_anos(pasta_dados)
+                     if os.path.exists(data_path(perfil, ano, pasta_dados))]
+            for perfil in PERFIS}
+
+def satisfaction_index(perfil, ano, selection, pasta_dados='data'):
+    cube = load_cube(perfil, ano, pasta_dados)
+    cells, respondentes = _cells(cube, selection)
+    texts, groups = _questions(perfil, pasta_dados)
+    stats = cube.stats(cells).rename(columns={'index': 'indice', 'valid': 'validas'})
+    stats.insert(0, 'item', stats.index)
+    stats.insert(1, 'grupo', groups.reindex(stats.index).values)
+    stats.insert(2, 'texto', texts.reindex(stats.index).values)
+    return {'perfil': perfil, 'ano': ano, 'selecao': selection, 'respondentes': respondentes,
+            'itens': _records(stats)}
+
+def percentage_table(perfil, ano, selection, pasta_dados='data'):
+    cube = load_cube(perfil, ano, pasta_dados)
+    cells, respondentes = _cells(cube, selection)
+    texts, _ = _questions(perfil, pasta_dados)
+    percentages = cube.percentages(cells).round(2)
+    itens = [{'item': item, 'texto': texts.get(item), 'percentuais': row}
+             for item, row in zip(percentages.index, _records(percentages))]
+    return {'perfil': perfil, 'ano': ano, 'selecao': selection, 'respondentes': respondentes,
+            'itens': itens}
+
+def comparison(perfil, anos, selection, pasta_dados='data'):
+    # Index per year and item, as in the Comparação tab, with the
+    # significant changes since the previous year (significance.py)
+    C = load_years(perfil, anos, pasta_dados)
+    present = {f: v for f, v in selection.items() if f in C.columns}
+    rows = FilterIndex(C, list(present)).select(present)
+    # As in _cells: a facet the profile does not have matches nobody
+    if len(present) < len(selection):
+        rows[:] = False
+    C = C[rows]
+    counts = C['Ano'].value_counts()
+    C = C[suppress_single(C['Ano'].map(counts).to_numpy()) > 0]
+    texts, groups = _questions(perfil, pasta_dados)
+    engine = SatisfactionEngine(C, list(texts.index))
+    index = engine.index_by(C['Ano'])
+    changed = year_changes(engine, C['Ano'])
+    itens = [{'item': item, 'grupo': groups.get(item), 'texto': texts.get(item),
+              'indices': _records(index[[item]].T)[0],
+              'variacao_significativa': {ano: bool(v) for ano, v in changed[item].items()}}
+             for item in index.columns]
+    return {'perfil': perfil, 'anos': [str(a) for a in index.index], 'selecao': selection,
+            'respondentes': {str(a): int(counts.get(a, 0)) for a in anos}, 'itens': itens}
+
+
+def response(build):
+    # (ETag, body) of a JSON result, the ETag being a hash of the body
+    def encode():
+        body = json.dumps(build(), ensure_ascii=False).encode('utf-8')
+        return '"' + hashlib.sha256(body).hexdigest()[:32] + '"', body
+    return encode
+
+def route(path, params, pasta_dados='data'):
+    # (cache key, builder) of a request
+    if path == '/perfis':
+        anos = profiles(pasta_dados)
+        stamps = tuple(data_version(perfil, anos[perfil], pasta_dados) for perfil in PERFIS)
+        return (path, stamps), response(lambda: anos)
+    if path in ('/indice', '/percentual'):
+        perfil, ano = _perfil_ano(params, pasta_dados)
+        selection = _selection(params)
+        build = satisfaction_index if path == '/indice' else percentage_table
+        key = (path, perfil, ano, selection_key(selection), data_version(perfil, [ano], pasta_dados))
+        return key, response(lambda: build(perfil, ano, selection, pasta_dados))
+    if path == '/comparacao':
+        perfil = params.get('perfil', [None])[0]
+        if perfil not in PERFIS:
+            raise ApiError(400 if perfil is None else 404, 'informe um perfil válido')
+        anos = profiles(pasta_dados)[perfil]
+        if 'ano' in params:
+            missing = set(params['ano']) - set(anos)
+            if missing:
+                raise ApiError(404, f'sem dados de {perfil} em {", ".join(sorted(missing))}')
+            anos = [ano for ano in anos if ano in params['ano']]
+        selection = _selection(params)
+        key = (path, perfil, tuple(anos), selection_key(selection),
+               data_version(perfil, anos, pasta_dados))
+        return key, response(lambda: comparison(perfil, anos, selection, pasta_dados))
+    raise ApiError(404, f'rota desconhecida: {path}')
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Set by serve()
+    cache = None
+    pasta_dados = 'data'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            key, build = route(url.path.rstrip('/') or '/', parse_qs(url.query), self.pasta_dados)
+            etag, body = self.cache.get(key, build, size=lambda entry: len(entry[1]))
+        except ApiError as e:
+            return self._error(e.status, str(e))
+        except Exception as e:
+            self.log_error('%s: %r', self.path, e)
+            return self._error(500, 'erro interno')
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            return self._send(304, b'', etag)
+        self._send(200, body, etag)
+
+    def _error(self, status, message):
+        self._send(status, json.dumps({'erro': message}, ensure_ascii=False).encode('utf-8'))
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+
+def serve(host='127.0.0.1', port=8502, pasta_dados='data', budget=BUDGET):
+    handler = type('Handler', (Handler,), {'cache': ResultCache(budget),
+                                           'pasta_dados': pasta_dados})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f'API em http://{host}:{port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='API JSON com os índices de satisfação')
+    parser.add_argument('--data', default='data', help='pasta com os dados por ano')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--cache', type=float, default=BUDGET / 2**20,
+                        help='memória para os resultados (MB)')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.data, int(args.cache * 2**20))
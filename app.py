@@ -1,86 +1,25 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-  
 import pandas as pd
-import csv
+import numpy as np
 import os
-
-def extract_questions_and_subquestions(file_path):
-    questions = {}
-    current_question = None
-
-    with open(file_path, mode='r', encoding='utf-8') as file:
-        reader = csv.reader(file, delimiter='\t')
-        
-        for row in reader:
-            if row[0] == 'Q':
-                # Extract question details
-                question_id = row[2]
-                question_text = row[4]
-                questions[question_id] = {
-                    'text': question_text,
-                    'subquestions': []
-                }
-                current_question = question_id
-            elif row[0] == 'SQ' and current_question:
-                # Extract subquestion details
-                subquestion_id = row[2]
-                subquestion_text = row[4]
-                questions[current_question]['subquestions'].append({
-                    'id': subquestion_id,
-                    'text': subquestion_text
-                })
-
-    return questions
-
-def transform_questions_to_dataframe(questions):
-    
-    Q=[]
-    # Print the extracted questions and subquestions
-    for question_id, question_data in questions.items():
-        if len(question_data['subquestions'])==0:
-            q={}
-            q['question_id']=question_id
-            q['question_data']=question_data['text']
-            q['subquestions'] = question_id#f"{question_id}"
-            q['text'] = question_data['text']
-            Q.append(q)
-        else:
-            for subquestion in question_data['subquestions']:
-                q={}
-                q['question_id']=question_id
-                q['question_data']=question_data['text']
-                q['subquestions'] = subquestion['id']
-                q['subquestions'] = f"{question_id}[{subquestion['id']}]"
-                q['text'] = subquestion['text']
-                Q.append(q)
-               
-           
-        
-    Q = pd.DataFrame(Q)
-    return Q
-
-
-def remove_single_occurrences(df,n=1):
-    for column in df.columns:
-        value_counts = df[column].value_counts()
-        to_remove = value_counts[value_counts <= n].index
-        df[column] = df[column].apply(lambda x: x if x not in to_remove else None)
-    return df
-
-def include_subquestion(A,Q, uploaded_file):
-    l=[]
-    for c in Q['subquestions'].values:        
-         if c in A.columns:
-            l.append(list(A[c].values))
-         else:
-            Q=Q[Q['subquestions']!=c]
-        
-        
-    Q['data']=l 
-    
-    output_csv_path = uploaded_file
-    Q.to_csv(output_csv_path, index=False, encoding='utf-8')
-    return Q
+from ingestion import (filter_columns, listar_anos, load_codebook, load_questions, load_survey,
+                       load_years, long_responses)
+from satisfaction import (BOOTSTRAP_SEED, NAO_SEI, SatisfactionEngine, answer_order,
+                          load_engine, satisfaction_table)
+from filters import load_filters, suppress_single
+from cube import load_cube, load_year_cubes, streams
+from dedup import load_duplicates
+from search import SEARCH_FACETS, load_index
+from themes import load_terms
+from significance import year_changes
+from charts import percentage_data, percentage_chart
+from results import RESULTS, cached_result
+from profiling import start_run, end_run, span
+
+def include_subquestion(A,Q):
+    # Keep only the subquestions answered in this export
+    return Q[Q['subquestions'].isin(A.columns)]
 
 
 #%%
@@ -99,14 +38,8 @@ def create_stacked_bar_charts(df, question_id):
         st.write(f"#### Subquestion: {subq}")
         subq_data = df[(df['question_id'] == question_id) & (df['subquestions'] == subq)]['data']
         
-        # Convert the string representation of the list to an actual list
-        subq_data = subq_data.apply(eval)
-        
-        # Flatten the list of lists
-        flat_data = [item for sublist in subq_data for item in sublist]
-        
         # Create a DataFrame for plotting
-        plot_df = pd.DataFrame(flat_data, columns=['Response'])
+        plot_df = pd.DataFrame({'Response': subq_data.values})
         
         # Count the frequency of each response
         response_counts = plot_df['Response'].value_counts().reset_index()
@@ -131,14 +64,8 @@ def create_barplots(df, question_id):
         st.write(f"#### Subquestion: {subq}")
         subq_data = df[(df['question_id'] == question_id) & (df['subquestions'] == subq)]['data']
         
-        # Convert the string representation of the list to an actual list
-        subq_data = subq_data.apply(eval)
-        
-        # Flatten the list of lists
-        flat_data = [item for sublist in subq_data for item in sublist]
-        
         # Create a DataFrame for plotting
-        plot_df = pd.DataFrame(flat_data, columns=['Response'])
+        plot_df = pd.DataFrame({'Response': subq_data.values})
         
         # Plot the bar plot
         fig, ax = plt.subplots()
@@ -154,12 +81,9 @@ def create_stacked_bar_plots(df, question_id):
     # Filter data for the current question_id
     question_data = df[df['question_id'] == question_id]
     
-    # Flatten the 'data' column (convert string lists to actual lists and flatten)
-    question_data['data'] = question_data['data'].apply(eval)
-    flattened_data = question_data.explode('data')
     
     # Create a DataFrame for plotting
-    plot_df = flattened_data.groupby(['subquestions', 'data']).size().reset_index(name='count')
+    plot_df = question_data.groupby(['subquestions', 'data']).size().reset_index(name='count')
     
     # Create a stacked Altair bar chart
     chart = alt.Chart(plot_df).mark_bar().encode(
@@ -181,12 +105,9 @@ def create_horizontal_stacked_bar_plots(df, question_id):
     # Filter data for the current question_id
     question_data = df[df['question_id'] == question_id]
     
-    # Flatten the 'data' column (convert string lists to actual lists and flatten)
-    question_data['data'] = question_data['data'].apply(eval)
-    flattened_data = question_data.explode('data')
     
     # Create a DataFrame for plotting
-    plot_df = flattened_data.groupby(['subquestions', 'data']).size().reset_index(name='count')
+    plot_df = question_data.groupby(['subquestions', 'data']).size().reset_index(name='count')
     
     # Create a horizontal stacked Altair bar chart
     chart = alt.Chart(plot_df).mark_bar().encode(
@@ -207,12 +128,9 @@ def create_horizontal_stacked_bar_plots_percentage(df, question_id):
     # Filter data for the current question_id
     question_data = df[df['question_id'] == question_id]
     
-    # Flatten the 'data' column (convert string lists to actual lists and flatten)
-    question_data['data'] = question_data['data'].apply(eval)
-    flattened_data = question_data.explode('data')
     
     # Create a DataFrame for plotting
-    plot_df = flattened_data.groupby(['subquestions', 'data']).size().reset_index(name='count')
+    plot_df = question_data.groupby(['subquestions', 'data']).size().reset_index(name='count')
     
     # Calculate the total count for each subquestion
     total_counts = plot_df.groupby('subquestions')['count'].transform('sum')
@@ -239,12 +157,9 @@ def create_percentage_table(df, question_data):
     # Filter data for the current question_data
     question_data_df = df[df['question_data'] == question_data]
     
-    # Flatten the 'data' column (convert string lists to actual lists and flatten)
-    question_data_df['data'] = question_data_df['data'].apply(eval)
-    flattened_data = question_data_df.explode('data')
     
     # Create a DataFrame for the table
-    plot_df = flattened_data.groupby(['text', 'data']).size().reset_index(name='count')
+    plot_df = question_data_df.groupby(['text', 'data']).size().reset_index(name='count')
     
     # Calculate the total count for each "text" entry
     total_counts = plot_df.groupby('text')['count'].transform('sum')
@@ -264,178 +179,28 @@ def create_percentage_table(df, question_data):
 
 
 # Function to create horizontal stacked Altair bar plots with percentages for the "text" column
-def create_horizontal_stacked_bar_plots_percentage_data(df, question_data):
-    st.write(f"### - {question_data}")
-    
-    # Filter data for the current question_data
-    question_data_df = df[df['question_data'] == question_data]
-    
-    # Flatten the 'data' column (convert string lists to actual lists and flatten)
-    question_data_df['data'] = question_data_df['data'].apply(eval)
-    flattened_data = question_data_df.explode('data')
-    
-    # Create a DataFrame for plotting
-    plot_df = flattened_data.groupby(['text', 'data']).size().reset_index(name='count')
-    
-    # Calculate the total count for each "text" entry
-    total_counts = plot_df.groupby('text')['count'].transform('sum')
-    
-    # Calculate the percentage of each response
-    plot_df['percentage'] = (plot_df['count'] / total_counts) * 100
-    
-    # Create a horizontal stacked Altair bar chart with percentages
-    chart = alt.Chart(plot_df).mark_bar().encode(
-        y=alt.Y('text:N', title='Text', axis=alt.Axis(labelLimit=200)),  # Text on the y-axis with increased label limit
-        x=alt.X('percentage:Q', title='Porcentagem (%)', scale=alt.Scale(domain=[0, 100])),  # Percentage on the x-axis
-        color=alt.Color('data:N', title='Resposta', legend=alt.Legend(orient='bottom')),  # Stack by response type
-        tooltip=['text', 'data', alt.Tooltip('percentage:Q', format='.2f')]  # Add tooltips for interactivity
-    )#.properties(
-    #    title=f"Response Distribution for - {question_data} (Percentage)",
-    #    width='container'  # Make the chart responsive to container width
-    #)#.configure_axis(
-    #    labelFontSize=12,  # Increase font size for better readability
-    #    titleFontSize=14
-    #).configure_legend(
-    #    titleFontSize=12,
-    #    labelFontSize=12
-    #)
-    
-    # Display the chart in Streamlit with full width
-    st.altair_chart(chart, use_container_width=True)
-
-
-def fun_exc_estudantes(A):
-    
-    dic_exc={}
-    dic_exc[ 'Area'						]=	'Unidade'
-    dic_exc[ 'Campus'					]=	'Campus'
-    dic_exc[ 'Nivel'					]=	'Perfil'
-    dic_exc[ 'Nivelcurso'	    		]=	'Perfil'
-    dic_exc[ 'Avaliasetores[PROAE]'		]=	'AvaliaSetores[PROAE]'
-    dic_exc[ 'Avaliasetores[PROCULT]'	]=	'AvaliaSetores[PRCUL]'
-    dic_exc[ 'Avaliasetores[PROEX]'		]=	'AvaliaSetores[PROEX]'
-    dic_exc[ 'Avaliasetores[PROGRAD]'	]=	'AvaliaSetores[PRGRA]'
-    dic_exc[ 'Avaliasetores[PROPP]'		]=	'AvaliaSetores[PROPP]'
-    dic_exc[ 'Avaliasetores[DIAAF]'		]=	'AvaliaSetores[DIAAF]'
-    dic_exc[ 'Avaliasetores[DRI]'		]=	'AvaliaSetores[DRI]'
-    dic_exc[ 'Avaliasetores[COORD]'		]=	'AvaliaSetores[COORD]'
-    dic_exc[ 'Avaliasetores[OUVG]'		]=	'AvaliaSetores[OUVID]'
-    dic_exc[ 'Avaliasetores[CAT]'		]=	'AvaliaSetores[CATEND]'
-    dic_exc[ 'EstReg'					]=	'EstReg'
-    dic_exc[ 'Regimento'				]=	'RAGRI'
-    dic_exc[ 'OrgCol[DivDec]'			]=	'OrgCo[DivDec]'
-    dic_exc[ 'OrgCol[ImplDec]'			]=	'OrgCo[ImplDec]'
-    dic_exc[ 'OrgCol[RepDec]'			]=	'OrgCo[RepOrgCol]'
-    dic_exc[ 'CPA'						]=	'CPA'
-    dic_exc[ 'ApRecFin[DesAtEns]'		]=	'AplRF[DAtEn]'
-    dic_exc[ 'ApRecFin[DesAtPesq]'		]=	'AplRF[DAtPe]'
-    dic_exc[ 'ApRecFin[DesAtEx]'		]=	'AplRF[DAtEx]'
-    dic_exc[ 'ApRecFin[DesAtInov]'		]=	'AplRF[DAtInov]'
-    dic_exc[ 'ApRecFin[AqEqIns]'		]=	'AplRF[AqEqi]'
-    dic_exc[ 'ApRecFin[ManAmpRef]'		]=	'AplRF[MAREF]'
-    dic_exc[ 'ApRecFin[BProjPesqEx]'	]=	'AplRF[BProj]'
-    dic_exc[ 'ApRecFin[BMonitTP]'		]=	'AplRF[BMoTP]'
-    dic_exc[ 'ApRecFin[ConcAux]'		]=	'AplRF[CAVS]'
-    dic_exc[ 'TranspInv'				]=	'TrInv'
-    dic_exc[ 'AvaliaSetores[PROINOV]'	]=	'AvaliaSetores[PROINOV]'
-    dic_exc[ 'Qaberta'               	]=	'Qaberta'
-    
-    #exc_dic=dict(zip(dic_exc.values(), dic_exc.keys()))
-    
-    B=pd.DataFrame()
-    for c in A.columns:
-        if c  in dic_exc.keys():
-            B[dic_exc[c]]=A[c]
-        else:
-            B[c]=A[c]
-
-    for c in dic_exc.values():
-        if c  not in B.columns:
-            B[c]=None
-            
-    
-    return B
-
-
-def fun_exc_servidores(A):
-    
-    dic_exc={}
-    dic_exc['Perfil'        	    ]=	'Perfil'
-    dic_exc['Campus'	            ]=	'Campus'
-    dic_exc['Area'	                ]=	'LOTACAO'
-    dic_exc['Capacitacao'	        ]=	'CAP'
-    dic_exc['Qualificacao'	        ]=	'Proquali'
-    dic_exc['Acoesdesenv'	        ]=	'Acoesdesenv'
-    dic_exc['apoiofin'	            ]=	'Apoio'
-    dic_exc['DistCHDoc'	            ]=	'CHdocente'
-    dic_exc['DistCHTae'	            ]=	'CHTAE'
-    dic_exc['Qualivida'	            ]=	'Qualivida'
-    dic_exc['Saudeocupa'	        ]=	'Saudeocupacional'
-    dic_exc['Divulgacarr'	        ]=	'DivulCarreira'
-    dic_exc['ClimaOrg'	            ]=	'Ambiente'
-    dic_exc['Motivacao'	            ]=	'Motivacao'
-    dic_exc['OrgCol[DivDec]'	    ]=	'ORGCOL[DIVDEC]'
-    dic_exc['OrgCol[ImplDec]'	    ]=	'ORGCOL[IMPLDEC]'
-    dic_exc['OrgCol[RepOrgCol]'	    ]=	'ORGCOL[REPORGCOL]'
-    dic_exc['AvaliaSetores[REIT]'	]=	'AVALIASETORES[REIT]'
-    dic_exc['AvaliaSetores[PROAE]'	]=	'AVALIASETORES[PROAE]'
-    dic_exc['AvaliaSetores[PROPP]'	]=	'AVALIASETORES[PROPP]'
-    dic_exc['AvaliaSetores[PRGRA]'	]=	'AVALIASETORES[PRGRA]'
-    dic_exc['AvaliaSetores[PROEX]'	]=	'AVALIASETORES[PROEX]'
-    dic_exc['AvaliaSetores[PRCUL]'	]=	'AVALIASETORES[PRCUL]'
-    dic_exc['AvaliaSetores[PRINF]'	]=	'AVALIASETORES[PRINF]'
-    dic_exc['AvaliaSetores[PRGPE]'	]=	'AVALIASETORES[PRGPE]'
-    dic_exc['AvaliaSetores[DUX]'	]=	'AVALIASETORES[DUX]'
-    dic_exc['AVALIASETORES[PRGEF]'	]=	'AVALIASETORES[PRGEF]'
-    dic_exc['AvaliaSetores[PRPLA]'	]=	'AVALIASETORES[PROPLAN]'
-    dic_exc['AvaliaSetores[DI]'	    ]=	'AVALIASETORES[PRINOV]'
-    dic_exc['AVALIASETORES[PRODAV]'	]=	'AVALIASETORES[PRODAV]'
-    dic_exc['AvaliaSetores[DRI]'	]=	'AVALIASETORES[DRI]'
-    dic_exc['AvaliaSetores[DII]'	]=	'AVALIASETORES[DII]'
-    dic_exc['AvaliaSetores[CDX]'	]=	'AVALIASETORES[CDX]'
-    dic_exc['AvaliaSetores[DIRGGV]'	]=	'AVALIASETORES[DIRGGV]'
-    dic_exc['AvaliaSetores[DIAFF]'	]=	'AVALIASETORES[DIAAF]'
-    dic_exc['AVALIASETORES[DSP]'	]=	'AVALIASETORES[DSP]'
-    dic_exc['AVALIASETORES[DCI]'	]=	'AVALIASETORES[DCI]'
-    dic_exc['EstReg'            	]=	'ESTREG'
-    dic_exc['RegUni'            	]=	'REGUNI'
-    dic_exc['CPA'               	]=	'CPA'
-    dic_exc['AplRF[DAtEn]'	        ]=	'APLRF[DAtEn]'
-    dic_exc['AplRF[DAtPe]'	        ]=	'APLRF[DAtPe]'
-    dic_exc['AplRF[DAtEx]'	        ]=	'APLRF[DAtEx]'
-    dic_exc['AplRF[DAtInov]'	    ]=	'APLRF[DAtInov]'
-    dic_exc['AplRF[AqEqi]'	        ]=	'APLRF[AqEqi]'
-    dic_exc['AplRF[MAREF]'	        ]=	'APLRF[MAREF]'
-    dic_exc['AplRF[InCapS]'	        ]=	'APLRF[InCapS]'
-    dic_exc['AplRF[BProj]'	        ]=	'APLRF[BProj]'
-    dic_exc['AplRF[BMoTP]'	        ]=	'APLRF[BMoTP]'
-    dic_exc['TrInv'	                ]=	'TrInv'
-    dic_exc['ABERTA'	            ]=	'ABERTA'
-    dic_exc['AtivAdm'	            ]=	'AtivAdm'
-    dic_exc['SitTrab'	            ]=	'SitTrab'
-    dic_exc['Qualicursos'	        ]=	'Qualicursos'
-    dic_exc['AvaliaSetores[DIAVI]'	]=	'AvaliaSetores[DIAVI]'
-    
-    B=pd.DataFrame()
-    for c in A.columns:
-        if c  in dic_exc.keys():
-            B[dic_exc[c]]=A[c]
-        else:
-            B[c]=A[c]
-
-    for c in dic_exc.values():
-        if c  not in B.columns:
-            B[c]=None
-            
-    
-    return B
+def create_horizontal_stacked_bar_plots_percentage_data(df, question_data, order=None, memo=None,
+                                                        title=True):
+    # memo(build) returns the chart from a cache (see results.py); df may
+    # then be a function returning the long table, called on a miss only
+    with span('render', group=question_data):
+        if title:
+            st.write(f"### - {question_data}")
+        
+        build = lambda: percentage_chart(percentage_data(df() if callable(df) else df,
+                                                         question_data), order)
+        chart = build() if memo is None else memo(build)
+        
+        # Display the chart in Streamlit with full width
+        st.altair_chart(chart, use_container_width=True)
 
+def group_section(question_data, key, lazy, opened=False):
+    # In lazy mode every question group is a collapsible section whose
+    # content is computed only while it is open
+    if not lazy:
+        return True
+    return st.toggle(f'**{question_data}**', value=opened, key=key)
 
-# Função para listar as pastas (anos) dentro da pasta 'data'
-def listar_anos(diretorio):
-    # Obtém a lista de pastas dentro da pasta 'data'
-    anos = [pasta for pasta in os.listdir(diretorio) if os.path.isdir(os.path.join(diretorio, pasta))]
-    return sorted(anos)  # Ordena os anos de forma crescente
 
 
 styles = [dict(selector="th", props=[('width', '40px')]),
@@ -446,6 +211,8 @@ styles = [dict(selector="th", props=[('width', '40px')]),
                               ('horizontal-align', 'bottom'),
                               ('vertical-align', 'bottom')])]
 
+significant_style = 'font-weight: bold; border: 2px solid black'
+
 def color_coding_change_flag_2(val):
         if val==None or val=='':
             color = None
@@ -464,26 +231,6 @@ def color_coding_change_flag_2(val):
         return f'background-color: {color}'
     
 
-repl={
- 'Concordo'                   : '2-Concordo'                   ,
- 'Concordo totalmente'        : '1-Concordo totalmente'        ,
- 'Discordo'                   : '4-Discordo'                   ,
- 'Discordo totalmente'        : '5-Discordo totalmente'        ,
- 'Não concordo nem discordo'  : '3-Não concordo nem discordo'  ,
- 'Não sei / Não se aplica'    : '6-Não sei / Não se aplica'    ,
- '':'6-Não sei / Não se aplica' ,
-}
-
-repl0={
- 'Concordo'                   : 0.66,
- 'Concordo totalmente'        : 1,
- 'Discordo'                   : 0.33,
- 'Discordo totalmente'        : 0,
- 'Não concordo nem discordo'  : None,
- 'Não sei / Não se aplica'    : None,
- '':None,
-}
-
 #%%
     
 css = '''
@@ -497,8 +244,60 @@ css = '''
 #st.set_page_config(layout="wide")  # this needs to be the first Streamlit command
 st.markdown(css, unsafe_allow_html=True)
 
+def filter_respondents(index, cols, key, blank=''):
+    # One multiselect per column in cols of a FilterIndex; options show how
+    # many respondents each value would leave given the selection made on
+    # the other columns. Blank values are shown as `blank`. Returns the
+    # mask of the selected rows and the selection.
+    selection = {s: st.session_state.get(f'{key}-{s}') or [] for s in cols}
+    keys = {}
+    for s in cols:
+        counts = index.counts(selection, s)
+        options = st.multiselect(
+            label=f"{s}",
+            options = index.options(s),
+            default=None,
+            key=f'{key}-{s}',
+            format_func=lambda v, counts=counts: f'{v or blank} ({counts[v]})',
+        )
+        if len(options)>0 and not any('Tod' in k for k in options):
+            keys[s]=options
+        
+    st.markdown('Parâmetros selecionados:')
+    with span('filter'):
+        return index.select(keys), keys
+
+def show_debug_panel(spans):
+    st.sidebar.markdown('**Tempo por etapa**')
+    if not spans:
+        return
+    T = pd.DataFrame(spans)
+    T['ms'] = (T.pop('seconds') * 1000).round(1)
+    st.sidebar.metric('Total (ms)', round(T.loc[T['depth'] == 0, 'ms'].sum(), 1))
+    T['stage'] = ['· ' * d + s for d, s in zip(T.pop('depth'), T['stage'])]
+    st.sidebar.dataframe(T, hide_index=True)
+    cache = RESULTS.stats()
+    st.sidebar.markdown('**Cache de resultados**')
+    col = st.sidebar.columns(3)
+    col[0].metric('Acertos', cache['hits'])
+    col[1].metric('Falhas', cache['misses'])
+    col[2].metric('Descartes', cache['evictions'])
+    st.sidebar.progress(min(cache['bytes'] / cache['budget'], 1.0),
+                        text=f"{cache['entries']} resultados, {cache['bytes'] / 2**20:.1f} de "
+                             f"{cache['budget'] / 2**20:.0f} MB")
+
 # Streamlit app
 def main():
+    debug = st.sidebar.checkbox('Painel de desempenho', value=False)
+    start_run(memory=debug)
+    try:
+        dashboard()
+    finally:
+        spans = end_run(page='dashboard')
+    if debug:
+        show_debug_panel(spans)
+
+def dashboard():
 
     st.header("Universidade Federal de Juiz de Fora")
     st.markdown("[**Comissão Própria de Avaliação**](https://www2.ufjf.br/cpa/)")
@@ -509,75 +308,77 @@ def main():
 
     perfil_selecionado = st.radio("Escolha o Perfil para análise", ['Estudantes', 'Servidores'])
     pasta_dados = "data"
-
-    fun_exc={
-        'Estudantes': fun_exc_estudantes,
-        'Servidores': fun_exc_servidores,
-        } 
+    # Repeated submissions (same closed answers, same or blank comment) are
+    # kept unless excluded here; see dedup.py
+    excluir_duplicatas = st.sidebar.checkbox('Excluir submissões duplicadas', value=False)
+    # Only the first group of each tab is computed on the first paint
+    lazy = st.sidebar.checkbox('Carregar grupos sob demanda', value=True)
     
 
-    tab1, tab2, tab3 = st.tabs(["Resultados", "Comparação", 'Dados'])
+    tab1, tab2, tab3, tab4 = st.tabs(["Resultados", "Comparação", 'Dados', 'Comentários'])
     with tab2:
     
         anos = listar_anos(pasta_dados)[::-1]
+        # Exports too large to be loaded (cube.STREAM_BYTES) are compared from
+        # their answer cubes, without the duplicate filter; Dados and
+        # Comentários are not shown for them
+        grande = any(streams(perfil_selecionado, ano, pasta_dados) for ano in anos)
+        excluir_anos = excluir_duplicatas and not grande
+        if grande and excluir_duplicatas:
+            st.info('Exportação grande demais para excluir as submissões duplicadas.')
         # Cria um seletor de ano a partir das pastas listadas
-        C=pd.DataFrame()
-        for ano_selecionado in anos:
-            cod_path = f'./data/2024/Códigos_{perfil_selecionado}.csv'
-            file_path = f'./data/{ano_selecionado}/{perfil_selecionado}_dados_{ano_selecionado}.csv'
-            uploaded_file = f'questions_and_subquestions_{perfil_selecionado}.csv'
-            questions = extract_questions_and_subquestions(cod_path)
-            A = pd.read_csv(file_path, sep=';', keep_default_na=False)
-            questions = extract_questions_and_subquestions(cod_path)
-            A = pd.read_csv(file_path, sep=';', keep_default_na=False)
-            A=fun_exc[perfil_selecionado](A)    
-            A = remove_single_occurrences(A)
-            A.fillna('', inplace=True)
-            A['Ano']=ano_selecionado
-            C = pd.concat([C,A])
-            Q = transform_questions_to_dataframe(questions)
-            Q = include_subquestion(A,Q, uploaded_file)
-            dic_q = dict(zip(Q['subquestions'].values,Q['text'].values))
+        with span('ingestion', perfil=perfil_selecionado, ano='todos'):
+            Q = load_questions(perfil_selecionado, pasta_dados)
+            if grande:
+                engine = load_year_cubes(perfil_selecionado, anos, pasta_dados, Q['subquestions'])
+                Q = Q[Q['subquestions'].isin(engine.items)]
+                groups = anos
+            else:
+                C = load_years(perfil_selecionado, anos, pasta_dados)
+                groups = C['Ano']
+        if excluir_anos:
+            with span('dedup', perfil=perfil_selecionado, ano='todos'):
+                C = C[~np.concatenate([load_duplicates(perfil_selecionado, ano, pasta_dados)['duplicata']
+                                       for ano in anos])]
+                groups = C['Ano']
+        if not grande:
+            Q = include_subquestion(C,Q)
+        dic_q = dict(zip(Q['subquestions'].values,Q['text'].values))
+        # Year x item matrix of indexes, one grouped aggregation for all years
+        def compare():
+            with span('aggregation', tab='comparacao'):
+                engine_anos = engine if grande else SatisfactionEngine(C, Q['subquestions'])
+                index = engine_anos.index_by(groups)
+            # Changes since the previous year, all items tested together
+            with span('significance', tab='comparacao'):
+                return index, year_changes(engine_anos, groups)
+        index, changed = cached_result(perfil_selecionado, anos, {}, ('comparacao', excluir_anos),
+                                       compare, pasta_dados, persist=True)
+        st.caption('Em negrito e com borda: variação significativa em relação ao ano anterior '
+                   '(teste de duas proporções ou qui-quadrado, correção de Benjamini-Hochberg, 5%).')
            
-        D=[]
         question_data_values = Q['question_data'].unique()
-        for ano, A in C.groupby('Ano'):
-            print('----\n'*12)
-            for question_data in question_data_values:
-                #print(f"### - {question_data}")
-                # Filter data for the current question_data
-                question_data_df = Q[Q['question_data'] == question_data]
-                cols=list(question_data_df['subquestions'].unique())
-                print('\n', cols)
-                
-                B=A[cols].replace(repl0).select_dtypes(include=['number'])
-                satisfaction_index = (B.sum(skipna=True)/B.count()*100).round(2)
-                neg=((1-B.count()/len(B))*100).round(2)
-                satisfaction_index.index = [dic_q[i] for i in satisfaction_index.index]
-                satisfaction_index = pd.DataFrame(satisfaction_index, columns = ['Indice de Satisfação (%)'])
-                print(ano, satisfaction_index)
-                D.append({'Ano':ano, 'Item':question_data, 'df':satisfaction_index})
-    
-        D = pd.DataFrame(D)            
-        for i, df in D.groupby('Item'):
-            print(i)
-            c=pd.DataFrame()
-            for a, da in df.groupby('Ano'):
-                aux=da['df'].iloc[0]
-                aux.columns=[a]
-                c[a]=aux[a]
+        for i in sorted(question_data_values):
+            question_data_df = Q[Q['question_data'] == i]
+            cols=[k for k in question_data_df['subquestions'].unique() if k in index.columns]
+            c = index[cols].T.dropna(how='all')
+            flags = changed[c.index].T
+            c.index = flags.index = [dic_q[k] for k in c.index]
             
-            print(c)
             if len(c)>0:
-                st.write(f"### - {i}")
-                st.table(
-                    c.style.applymap(
-                        color_coding_change_flag_2, #subset=NPS.columns.drop('Ambiente'),
-                    ).set_table_styles(styles).format("{:.1f}"),
-                    #height=1200,
-                    #hide_index=False,
-                    #use_container_width=True,
-                )
+                with span('render', group=i):
+                    st.write(f"### - {i}")
+                    st.table(
+                        c.style.applymap(
+                            color_coding_change_flag_2, #subset=NPS.columns.drop('Ambiente'),
+                        ).apply(
+                            lambda _, flags=flags: flags.replace({True: significant_style, False: ''}),
+                            axis=None,
+                        ).set_table_styles(styles).format("{:.1f}", na_rep='-'),
+                        #height=1200,
+                        #hide_index=False,
+                        #use_container_width=True,
+                    )
     
 
     with tab1:
@@ -587,117 +388,99 @@ def main():
         caminho_pasta_ano = os.path.join(pasta_dados, ano_selecionado)
        
         
-        cod_path = f'./data/2024/Códigos_{perfil_selecionado}.csv'
-        file_path = f'./data/{ano_selecionado}/{perfil_selecionado}_dados_{ano_selecionado}.csv'
-        uploaded_file = f'questions_and_subquestions_{perfil_selecionado}.csv'
-    
-        questions = extract_questions_and_subquestions(cod_path)
-        A = pd.read_csv(file_path, sep=';', keep_default_na=False)
-        A=fun_exc[perfil_selecionado](A)    
-        A = remove_single_occurrences(A)
-        A.fillna('', inplace=True)     
-        A.drop(['Unidade','LOTACAO'], axis=1, errors='ignore', inplace=True)
-        #A.replace(repl, inplace=True)
+        cols = filter_columns(perfil_selecionado, ano_selecionado, pasta_dados)
+        # Exports too large to be loaded (cube.STREAM_BYTES) are shown from
+        # the cube alone: the filters count its cells, and there are no
+        # intervals nor duplicate filter, which need the respondent rows
+        grande = streams(perfil_selecionado, ano_selecionado, pasta_dados)
+        with span('ingestion', perfil=perfil_selecionado, ano=ano_selecionado):
+            cube = load_cube(perfil_selecionado, ano_selecionado, pasta_dados)
+            if grande:
+                cols = [c for c in cols if c in cube.dims]
+            with span('filter_index'):
+                index = load_filters(perfil_selecionado, ano_selecionado, cols, pasta_dados,
+                                     cells=grande)
+        if grande and excluir_duplicatas:
+            st.info('Exportação grande demais para excluir as submissões duplicadas.')
+            excluir_duplicatas = False
+        if excluir_duplicatas:
+            with span('dedup', perfil=perfil_selecionado, ano=ano_selecionado):
+                mantidas = ~load_duplicates(perfil_selecionado, ano_selecionado, pasta_dados)['duplicata'].to_numpy()
+            # Repeated submissions count for nothing and are never selected
+            index = index.weighted(mantidas)
         
-        keys_dict = {}
-        length={}
-        nn=2
-        cols=sorted(A.columns[:nn])
-        for s in cols:
-            #s = A.columns[i]
-            #op = list(A[A.columns[i]].unique())
-            op = list(A[s].unique())
-            options = st.multiselect(
-                label=f"{s}",
-                options = op,
-                default=None,
-                key=f'res-{s}',
-            )
-            keys_dict[s]=options
-            length[s]=len(options)
-    
-        keys=keys_dict.copy()
-        for nam,opt in keys_dict.items():
-            print(nam,opt)
-            if len(opt)==0:
-                keys.pop(nam)
-            for k in opt:
-                if 'Tod' in k:
-                    keys.pop(nam)
-               
-           #df_selected=X.copy()    
-        st.markdown('Parâmetros selecionados:')    
-        if len(keys)>0:    
-            q=''
-            for nam,opt in keys.items():
-                #print(nam)
-                s='('
-                for i,k in enumerate(opt):
-                    #print('\t\t--',k)
-                    s+=f'{nam}=="{k}"'
-                    if i<len(opt)-1:
-                        s+=' | '
-                
-                s+=')'
-                #print(s)
-                q+=s+'&'
-                #aux=X.query(f'{nam}=="{k}"', inplace=True)
-                #st.metric(label=nam+':\t', value=k, delta="")
-            df_selected = A.query(q[:-1])
-        else:
-            df_selected = A.copy()                            
-    
-    
-        if len(df_selected)==1:
-                df_selected.drop(labels=df_selected.index[0],axis=0, inplace=True)
+        selected, keys = filter_respondents(index, cols, 'res')
+        if excluir_duplicatas:
+            selected &= mantidas
+        respondentes = suppress_single(index.total(selected))
+        if not respondentes:
+                selected[:] = False
                 
         col = st.columns(1)
         #for i in range(nn):
         #    s, v = list(length.keys())[i], list(length.values())[i]
         #    col[i].metric(label=s, value=v, delta="")
     
-        col[0].metric(label='Respondentes', value=len(df_selected), delta="")
+        col[0].metric(label='Respondentes', value=respondentes, delta="")
     
                 
-        Q = transform_questions_to_dataframe(questions)
-        Q = include_subquestion(df_selected,Q, uploaded_file)
+        Q = load_questions(perfil_selecionado, pasta_dados)
+        Q = Q[Q['subquestions'].isin(cube.items)]
         dic_q = dict(zip(Q['subquestions'].values,Q['text'].values))
     
       
+        # A selection too small to show is emptied above; the rows of the
+        # filter index are those of the engine
+        def index_stats():
+            with span('aggregation', tab='resultados'):
+                if excluir_duplicatas:
+                    # The cube counts every submission; score the kept rows directly
+                    return engine.stats(selected)
+                return cube.stats(cube.select(keys) & (respondentes > 0))
+        def bootstrap():
+            with span('bootstrap', tab='resultados'):
+                return engine.intervals(selected)
+        if not grande:
+            engine = load_engine(perfil_selecionado, ano_selecionado, pasta_dados)
+        stats = cached_result(perfil_selecionado, ano_selecionado, keys,
+                              ('indice', excluir_duplicatas), index_stats, pasta_dados,
+                              persist=True)
+        intervals = None if grande else cached_result(
+            perfil_selecionado, ano_selecionado, keys,
+            ('intervalos', excluir_duplicatas, BOOTSTRAP_SEED), bootstrap, pasta_dados,
+            persist=True)
+      
         question_data_values = Q['question_data'].unique()
-        for question_data in question_data_values:
+        shown = 0
+        for n, question_data in enumerate(question_data_values):
             #print(f"### - {question_data}")
             # Filter data for the current question_data
             question_data_df = Q[Q['question_data'] == question_data]
             cols=list(question_data_df['subquestions'].unique())
-            print('\n', cols)
-           
-            B=df_selected[cols].replace(repl0).select_dtypes(include=['number'])
-            satisfaction_index = (B.sum(skipna=True)/B.count()*100).round(2)
-            neg=((1-B.count()/len(B))*100).round(2)
-            satisfaction_index.index = [dic_q[i] for i in satisfaction_index.index]
-            satisfaction_index = pd.DataFrame(satisfaction_index, columns = ['Indice de Satisfação (%)'])
+            if not stats.index.isin(cols).any():
+                continue
+            shown += 1
+            if not group_section(question_data, f'res-grupo-{n}', lazy, shown == 1):
+                continue
+            satisfaction_index = satisfaction_table(stats, cols, dic_q, intervals=intervals)
             #satisfaction_index['Não sei/Não se aplica (%)'] = neg.values
             if len(satisfaction_index)>0:
-                st.write(f"### - {question_data}")
-                st.table(
-                    satisfaction_index.style.applymap(
-                        color_coding_change_flag_2, #subset=NPS.columns.drop('Ambiente'),
-                    ).set_table_styles(styles).format("{:.1f}"),
-                    #height=1200,
-                    #hide_index=False,
-                    #use_container_width=True,
-                )
-    
-    
-        B=df_selected[list(dic_q.keys())].replace(repl0).select_dtypes(include=['number'])
-        satisfaction_index = (B.sum(skipna=True)/B.count()*100).round(2)
-        neg=((1-B.count()/len(B))*100).round(2)
-        satisfaction_index.index = [dic_q[i] for i in satisfaction_index.index]
-        satisfaction_index = pd.DataFrame(satisfaction_index, columns = ['Indice de Satisfação (\%)'])
-        #satisfaction_index['Item avaliado'] = [dic_q[i] for i in satisfaction_index.index]
-        #satisfaction_index = satisfaction_index[['Item avaliado','Indice de Satisfação (\%)']]
-        satisfaction_index['Não sei/Não se aplica (%)'] = neg.values
+                with span('render', group=question_data):
+                    if not lazy:
+                        st.write(f"### - {question_data}")
+                    st.table(
+                        satisfaction_index.style.applymap(
+                            color_coding_change_flag_2, subset=satisfaction_index.columns[:1],
+                        ).set_table_styles(styles).format("{:.1f}", na_rep='-'),
+                        #height=1200,
+                        #hide_index=False,
+                        #use_container_width=True,
+                    )
+    
+    
+        satisfaction_index = satisfaction_table(stats, list(dic_q.keys()), dic_q,
+                                                'Indice de Satisfação (\%)',
+                                                'Não sei/Não se aplica (%)', intervals)
     
         #st.dataframe(satisfaction_index,use_container_width=True,hide_index=False)
         #st.bar_chart(satisfaction_index)
@@ -717,7 +500,7 @@ def main():
             #    color_coding_change_flag_2, #subset=NPS.columns.drop('Ambiente'),
             #).set_table_styles(styles).format("{:.1f}"),
     
-            satisfaction_index.style.set_table_styles(styles).format("{:.1f}"),
+            satisfaction_index.style.set_table_styles(styles).format("{:.1f}", na_rep='-'),
     
             #height=1200,
             #hide_index=False,
@@ -732,91 +515,84 @@ def main():
          caminho_pasta_ano = os.path.join(pasta_dados, ano_selecionado)
         
          
-         cod_path = f'./data/2024/Códigos_{perfil_selecionado}.csv'
-         file_path = f'./data/{ano_selecionado}/{perfil_selecionado}_dados_{ano_selecionado}.csv'
-         uploaded_file = f'questions_and_subquestions_{perfil_selecionado}.csv'
-     
-         questions = extract_questions_and_subquestions(cod_path)
-         A = pd.read_csv(file_path, sep=';', keep_default_na=False)
-         A=fun_exc[perfil_selecionado](A)    
-         A = remove_single_occurrences(A)
-         A.fillna('', inplace=True)       
-         A.replace(repl, inplace=True)
-         A.drop(['Unidade','LOTACAO'], axis=1, errors='ignore', inplace=True)
-
-         
-         keys_dict = {}
-         length={}
-         nn=2
-         cols=sorted(A.columns[:nn])
-         for s in cols:
-             #s = A.columns[i]
-             #op = list(A[A.columns[i]].unique())
-             op = list(A[s].unique())
-             options = st.multiselect(
-                 label=f"{s}",
-                 options = op,
-                 default=None,
-                 key=f'dados-{s}',
-             )
-             keys_dict[s]=options
-             length[s]=len(options)
-     
-         keys=keys_dict.copy()
-         for nam,opt in keys_dict.items():
-             print(nam,opt)
-             if len(opt)==0:
-                 keys.pop(nam)
-             for k in opt:
-                 if 'Tod' in k:
-                     keys.pop(nam)
-                
-            #df_selected=X.copy()    
-         st.markdown('Parâmetros selecionados:')    
-         if len(keys)>0:    
-             q=''
-             for nam,opt in keys.items():
-                 #print(nam)
-                 s='('
-                 for i,k in enumerate(opt):
-                     #print('\t\t--',k)
-                     s+=f'{nam}=="{k}"'
-                     if i<len(opt)-1:
-                         s+=' | '
-                 
-                 s+=')'
-                 #print(s)
-                 q+=s+'&'
-                     #aux=X.query(f'{nam}=="{k}"', inplace=True)
-                     #st.metric(label=nam+':\t', value=k, delta="")
-             df_selected = A.query(q[:-1])
+         if streams(perfil_selecionado, ano_selecionado, pasta_dados):
+             st.info('Exportação grande demais para exibir as respostas individuais.')
          else:
-             df_selected = A.copy()                            
-     
-     
-         if len(df_selected)==1:
-                 df_selected.drop(labels=df_selected.index[0],axis=0, inplace=True)
+             with span('ingestion', perfil=perfil_selecionado, ano=ano_selecionado):
+                 A = load_survey(perfil_selecionado, ano_selecionado, pasta_dados)
+             A = A.drop(['Unidade','LOTACAO'], axis=1, errors='ignore')
+             cols = filter_columns(perfil_selecionado, ano_selecionado, pasta_dados)
+             with span('filter_index'):
+                 index = load_filters(perfil_selecionado, ano_selecionado, cols, pasta_dados)
+
+             # Blank answers are shown as "não sei"
+             selected, keys = filter_respondents(index, cols, 'dados', blank=NAO_SEI)
+             if not suppress_single(index.total(selected)):
+                     selected[:] = False
+             df_selected = A[selected]
                  
-         col = st.columns(1)
-         #for i in range(nn):
-         #    s, v = list(length.keys())[i], list(length.values())[i]
-         #    col[i].metric(label=s, value=v, delta="")
+             col = st.columns(1)
+             #for i in range(nn):
+             #    s, v = list(length.keys())[i], list(length.values())[i]
+             #    col[i].metric(label=s, value=v, delta="")
      
-         col[0].metric(label='Respondentes', value=len(df_selected), delta="")
+             col[0].metric(label='Respondentes', value=len(df_selected), delta="")
      
-         Q = transform_questions_to_dataframe(questions)
-         Q = include_subquestion(df_selected,Q, uploaded_file)
+             codebook = load_codebook(perfil_selecionado, pasta_dados)
+             Q = codebook.frame()
+             Q = Q[Q['subquestions'].isin(df_selected.columns)]
 
-         #st.title("Question and Subquestion Analysis")
+             #st.title("Question and Subquestion Analysis")
         
-         if uploaded_file is not None:
-             df = pd.read_csv(uploaded_file)
-
-             question_data_values = df['question_data'].unique()
-            
-             for q_data in question_data_values:
-                 create_horizontal_stacked_bar_plots_percentage_data(df, q_data)
-    
+             question_ids = dict(zip(Q['question_data'], Q['question_id']))
+             question_data_values = Q['question_data'].unique() if len(df_selected) else []
+        
+             for n, q_data in enumerate(question_data_values):
+                 if not group_section(q_data, f'dados-grupo-{n}', lazy, n == 0):
+                     continue
+                 order = answer_order(codebook.labels(question_ids[q_data]))
+                 # The long table of the group is only built when the chart is
+                 # not memoized yet
+                 def group_responses(q_data=q_data):
+                     with span('aggregation', tab='dados', group=q_data):
+                         L = long_responses(df_selected, Q[Q['question_data'] == q_data])
+                         return L.replace({'data': {'': NAO_SEI}})
+                 memo = lambda build, q_data=q_data: cached_result(
+                     perfil_selecionado, ano_selecionado, keys, ('grafico', q_data), build, pasta_dados)
+                 create_horizontal_stacked_bar_plots_percentage_data(group_responses, q_data, order,
+                                                                     memo, title=not lazy)
+    
+
+    with tab4:
+         st.header("Comentários")
+         # The comments are read from the rows of every year
+         if grande:
+             st.info('Exportação grande demais para exibir os comentários.')
+         else:
+             with span('ingestion', perfil=perfil_selecionado, ano='todos'):
+                 index = load_index(perfil_selecionado, pasta_dados)
+             consulta = st.text_input("Buscar nos comentários", key='busca-consulta',
+                                      placeholder='ex.: restaurante universitario')
+             cols = [c for c in SEARCH_FACETS if c in index.facets.columns]
+             selected, keys = filter_respondents(index.filters, cols, 'busca')
+             st.columns(1)[0].metric(label='Comentários', value=index.filters.total(selected), delta="")
+             if consulta:
+                 with span('search'):
+                     resultados = index.search(consulta, keys, k=50)
+                 st.write(f"{len(resultados)} comentários encontrados")
+                 st.dataframe(resultados, use_container_width=True, hide_index=True)
+
+             st.subheader("Temas recorrentes")
+             with span('ingestion', perfil=perfil_selecionado, ano='todos'):
+                 termos = load_terms(perfil_selecionado, pasta_dados)
+             with span('themes'):
+                 col = st.columns(2)
+                 col[0].dataframe(termos.top_terms(keys), use_container_width=True, hide_index=True)
+                 col[1].dataframe(termos.top_terms(keys, bigrams=True), use_container_width=True,
+                                  hide_index=True)
+                 facetas = [c for c in ['Campus', 'Unidade', 'LOTACAO', 'Ano'] if c in termos.facets.columns]
+                 faceta = st.radio("Termos característicos por", facetas, horizontal=True, key='temas-faceta')
+                 st.dataframe(termos.compare(faceta, within=keys), use_container_width=True, hide_index=True)
     
     st.markdown('''
               ----------------------------------------------------\n
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Stage timings of the dashboard pipeline on synthetic exports, recorded to
+# a JSON baseline so regressions show up before deployment.
+#
+#   python bench.py --rows 10000 --rows 100000 --save benchmarks/baseline.json
+#   python bench.py --rows 10000 --rows 100000 --baseline benchmarks/baseline.json
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+from ingestion import (codebook_path, data_path, PERFIS, load_snapshot, long_responses,
+                       read_csv_survey, schema_path, snapshot_path, write_snapshot)
+from codebook import compile_codebook
+from cube import stream_cube
+from filters import FilterIndex
+from profiling import end_run, start_run
+from charts import percentage_data, percentage_chart
+from synthetic import write_export
+
+
+def _timed(timings, stage, fun, *args):
+    start = time.perf_counter()
+    result = fun(*args)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+def run_pipeline(perfil, ano, pasta_dados):
+    # Same steps as a Resultados + Dados rerun, one timing per stage, through
+    # the functions the app calls
+    t = {}
+    codebook = _timed(t, 'codebook', compile_codebook, codebook_path(perfil, pasta_dados))
+    Q = codebook.frame()
+    # csv_load, remap and suppress are the spans of read_csv_survey
+    start_run()
+    A = read_csv_survey(perfil, ano, pasta_dados)
+    t.update({s['stage']: s['seconds'] for s in end_run()})
+    path = data_path(perfil, ano, pasta_dados)
+    _timed(t, 'snapshot_write', write_snapshot, A, path, snapshot_path(perfil, ano, pasta_dados),
+           (schema_path(perfil, ano, pasta_dados),))
+    A = _timed(t, 'snapshot_load', load_snapshot, perfil, ano, None, pasta_dados)
+    cube = _timed(t, 'cube', stream_cube, perfil, ano, pasta_dados)
+
+    def select():
+        index = FilterIndex(A, ['Campus', 'Perfil'])
+        selection = {'Campus': index.options('Campus')[:1]}
+        return selection, index.select(selection)
+    selection, rows = _timed(t, 'filter', select)
+
+    def satisfaction():
+        return cube.stats(cube.select(selection))
+    _timed(t, 'satisfaction', satisfaction)
+
+    def percentages():
+        df = long_responses(A[rows], Q)
+        return [percentage_data(df, q) for q in df['question_data'].unique()]
+    tables = _timed(t, 'percentages', percentages)
+    _timed(t, 'chart_spec', lambda: [percentage_chart(p).to_dict() for p in tables])
+    return t
+
+def run(sizes, perfis=None, seed=0, repeat=1):
+    perfis = PERFIS if perfis is None else perfis
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            for perfil in perfis:
+                write_export(perfil, str(n), n, tmp, seed=seed)
+                runs = [run_pipeline(perfil, str(n), tmp) for _ in range(repeat)]
+                # best of `repeat` per stage
+                results[f'{perfil}/{n}'] = {s: min(r[s] for r in runs) for s in runs[0]}
+    return {
+        'meta': {'python': platform.python_version(), 'pandas': pd.__version__,
+                 'numpy': np.__version__, 'machine': platform.machine(),
+                 'date': time.strftime('%Y-%m-%d %H:%M:%S')},
+        'results': results,
+    }
+
+def regressions(current, baseline, tolerance=1.5, floor=0.02):
+    # Stages slower than tolerance x baseline; stages under `floor` seconds
+    # in the baseline are too noisy to compare
+    out = []
+    for case, stages in current['results'].items():
+        for stage, seconds in stages.items():
+            base = baseline['results'].get(case, {}).get(stage)
+            if base is not None and base >= floor and seconds > tolerance * base:
+                out.append((case, stage, base, seconds))
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tempos por etapa do pipeline em dados sintéticos')
+    parser.add_argument('--rows', type=int, action='append', help='respondentes (padrão: 10k, 100k, 1M)')
+    parser.add_argument('--perfil', action='append', help='perfil (padrão: todos)')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='grava o resultado como JSON (linha de base)')
+    parser.add_argument('--baseline', help='compara com uma linha de base JSON')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args()
+
+    current = run(args.rows or [10_000, 100_000, 1_000_000], args.perfil, args.seed, args.repeat)
+    print(pd.DataFrame(current['results']).T.round(4).to_string())
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(current, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            slow = regressions(current, json.load(file), args.tolerance)
+        for case, stage, base, seconds in slow:
+            print(f'REGRESSÃO {case} {stage}: {base:.4f}s -> {seconds:.4f}s')
+        sys.exit(1 if slow else 0)
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Chart specs of the Dados tab, kept free of Streamlit so they can be built
+# headless (benchmarks, static export).
+import altair as alt
+
+
+def percentage_data(df, question_data):
+    # Filter data for the current question_data (df is the long table)
+    question_data_df = df[df['question_data'] == question_data]
+    
+    # Create a DataFrame for plotting
+    plot_df = question_data_df.groupby(['text', 'data']).size().reset_index(name='count')
+    
+    # Calculate the total count for each "text" entry
+    total_counts = plot_df.groupby('text')['count'].transform('sum')
+    
+    # Calculate the percentage of each response
+    plot_df['percentage'] = (plot_df['count'] / total_counts) * 100
+    return plot_df
+
+def percentage_chart(plot_df, order=None):
+    # Horizontal stacked Altair bar chart with percentages; `order` lists the
+    # answers in legend and stacking order (alphabetical if None)
+    sort, stack = alt.Undefined, alt.Undefined
+    if order is not None:
+        rank = {label: i for i, label in enumerate(order)}
+        plot_df = plot_df.assign(ordem=plot_df['data'].map(rank))
+        sort, stack = order, alt.Order('ordem:Q')
+    return alt.Chart(plot_df).mark_bar().encode(
+        y=alt.Y('text:N', title='Text', axis=alt.Axis(labelLimit=200)),  # Text on the y-axis with increased label limit
+        x=alt.X('percentage:Q', title='Porcentagem (%)', scale=alt.Scale(domain=[0, 100])),  # Percentage on the x-axis
+        color=alt.Color('data:N', title='Resposta', legend=alt.Legend(orient='bottom'),
+                        sort=sort),  # Stack by response type
+        order=stack,
+        tooltip=['text', 'data', alt.Tooltip('percentage:Q', format='.2f')]  # Add tooltips for interactivity
+    )
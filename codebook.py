@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Compiled LimeSurvey codebook (Códigos_{perfil}.csv). The Q, SQ, A and G
+# rows are parsed once into a question tree with the export column names of
+# every question and its answer options (code, label). Likert answers are
+# coded by satisfaction.likert_codes, in the LEVELS order.
+import csv
+import pandas as pd
+
+
+class Codebook:
+
+    def __init__(self, questions):
+        # questions: {question_id: {'kind', 'text', 'help', 'group',
+        # 'subquestions': [(id, text)], 'answers': [(code, label)]}}
+        self.questions = questions
+        self.columns = {}
+        for question_id in questions:
+            for name in self.column_names(question_id):
+                self.columns[name] = question_id
+
+    def column_names(self, question_id):
+        # Export columns of a question: Q[SQ] per subquestion, or Q itself
+        subquestions = self.questions[question_id]['subquestions']
+        return [f'{question_id}[{s}]' for s, _ in subquestions] or [question_id]
+
+    def question(self, column):
+        return self.questions[self.columns.get(column, column)]
+
+    def labels(self, column):
+        # Answer labels of a column (or question id) in the codebook order
+        return [label for _, label in self.question(column)['answers']]
+
+    def tree(self):
+        # {question_id: {'text', 'subquestions': [{'id', 'text'}]}}, the
+        # layout of extract_questions_and_subquestions
+        return {question_id: {'text': q['text'],
+                              'subquestions': [{'id': s, 'text': t} for s, t in q['subquestions']]}
+                for question_id, q in self.questions.items()}
+
+    def frame(self):
+        # One row per export column, as transform_questions_to_dataframe
+        rows = []
+        for question_id, q in self.questions.items():
+            for (name, (_, text)) in zip(self.column_names(question_id),
+                                         q['subquestions'] or [(question_id, q['text'])]):
+                rows.append({'question_id': question_id, 'question_data': q['text'],
+                             'subquestions': name, 'text': text})
+        return pd.DataFrame(rows)
+
+
+def compile_codebook(file_path):
+    questions = {}
+    question = None
+    group = None
+    with open(file_path, mode='r', encoding='utf-8') as file:
+        for row in csv.reader(file, delimiter='\t'):
+            if not row:
+                continue
+            if row[0] == 'G':
+                group = row[2]
+            elif row[0] == 'Q':
+                question = {'kind': row[1], 'text': row[4], 'help': row[5],
+                            'group': group, 'subquestions': [], 'answers': []}
+                questions[row[2]] = question
+            elif row[0] == 'SQ' and question is not None:
+                question['subquestions'].append((row[2], row[4]))
+            elif row[0] == 'A' and question is not None:
+                question['answers'].append((row[2], row[4]))
+    return Codebook(questions)
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import json
+import numpy as np
+import pandas as pd
+from ingestion import (FACETS, SNAPSHOT_VERSION, cached, codebook_path, count_values,
+                       data_path, file_stamp, load_questions, load_survey, rare_values,
+                       read_survey_chunks, schema_path, survey_columns)
+from satisfaction import LEVELS, NAO_SEI, SCORES, SatisfactionEngine, likert_codes
+
+
+# Bump when the layout of the cube or the Likert coding changes so the
+# copies cached on disk are rebuilt.
+CUBE_VERSION = 1
+
+# Exports larger than this are aggregated chunk by chunk (stream_cube)
+# instead of being loaded whole. The dashboard then works from the cubes
+# alone: Resultados without the bootstrap intervals, Comparação from
+# YearCubes, neither with the duplicate filter; Dados and Comentários, which
+# need the respondent rows, are not shown.
+STREAM_BYTES = 256 * 2**20
+
+
+def cube_path(perfil, ano, pasta_dados='data'):
+    return os.path.join(pasta_dados, str(ano), f'{perfil}_cubo_{ano}.npz')
+
+
+class AnswerCube:
+    # Answer counts per demographic cell (a combination of the FACETS
+    # values), Likert item and answer code; the last code slot counts blank
+    # answers. A filter selection is a sum over cells, so indexes and
+    # percentage tables never touch the respondent rows.
+
+    def __init__(self, dims, cells, items, counts, respondents):
+        self.dims = list(dims)
+        self.cells = cells
+        self.items = list(items)
+        self.counts = counts
+        self.respondents = respondents
+
+    @classmethod
+    def from_frame(cls, A, columns=None, dims=None):
+        dims = [d for d in (FACETS if dims is None else dims) if d in A.columns]
+        engine = SatisfactionEngine(A, columns)
+        builder = CubeBuilder(dims, engine.items)
+        builder.add(A, engine.codes)
+        return builder.cube()
+
+    def select(self, selection):
+        # selection: {dim: [values]}, OR within a dim and AND across dims
+        mask = np.ones(len(self.cells), dtype=bool)
+        for dim, values in selection.items():
+            if len(values) > 0:
+                mask &= np.isin(self.cells[:, self.dims.index(dim)], list(values))
+        return mask
+
+    def total(self, cells=None):
+        counts = self.counts if cells is None else self.counts[cells]
+        return counts.sum(axis=0)
+
+    def stats(self, cells=None):
+        # Same frame as SatisfactionEngine.stats for the selected cells
+        counts = self.total(cells)
+        n = (self.respondents if cells is None else self.respondents[cells]).sum()
+        scored = np.isfinite(SCORES)
+        valid = counts[:, scored].sum(axis=1)
+        total = counts[:, scored] @ SCORES[scored]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = total / valid * 100
+            nao_sei = (1 - valid / n) * 100
+        return pd.DataFrame({'index': index, 'valid': valid, 'nao_sei': nao_sei},
+                            index=self.items).round(2)
+
+    def percentages(self, cells=None):
+        # Item x answer percentages by Likert level (blank = não sei)
+        labels = LEVELS + [NAO_SEI]
+        counts = pd.DataFrame(self.total(cells), index=self.items, columns=labels)
+        counts = counts.T.groupby(level=0, sort=False).sum().T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return counts.div(counts.sum(axis=1), axis=0) * 100
+
+    def save(self, path, stamp):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez_compressed(file, dims=np.array(self.dims, dtype=str),
+                                cells=self.cells, items=np.array(self.items, dtype=str),
+                                counts=self.counts, respondents=self.respondents,
+                                stamp=np.array(stamp))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            cube = cls(z['dims'].tolist(), z['cells'], z['items'].tolist(),
+                       z['counts'], z['respondents'])
+            return cube, str(z['stamp'])
+
+
+class YearCubes:
+    # The answer cubes of several years read as a SatisfactionEngine over
+    # their concatenation (counts_by, index_by, and so year_changes), for
+    # years too large to be loaded. Groups are the years themselves; an item
+    # missing in a year counts as blank there.
+
+    def __init__(self, cubes, columns=None):
+        self.cubes = cubes
+        present = [i for cube in cubes.values() for i in cube.items]
+        self.items = list(dict.fromkeys(present if columns is None else
+                                        [c for c in columns if c in present]))
+
+    def counts_by(self, groups):
+        # (sorted groups, group x item x level answer counts), as
+        # SatisfactionEngine.counts_by
+        groups = np.unique(np.asarray(groups))
+        counts = np.zeros((len(groups), len(self.items), len(LEVELS) + 1), dtype=np.int64)
+        for g, ano in enumerate(groups):
+            cube = self.cubes[ano]
+            total = cube.total()
+            counts[g, :, -1] = cube.respondents.sum()
+            for j, item in enumerate(self.items):
+                if item in cube.items:
+                    counts[g, j] = total[cube.items.index(item)]
+        return groups, counts
+
+    def index_by(self, groups):
+        groups, counts = self.counts_by(groups)
+        scored = np.isfinite(SCORES)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = counts[..., scored] @ SCORES[scored] / counts[..., scored].sum(axis=-1) * 100
+        return pd.DataFrame(index, index=groups, columns=self.items).round(2)
+
+
+class CubeBuilder:
+    # Adds the respondents of successive frames (chunks of one export) to
+    # the counts; cells are matched by their facet values, so memory grows
+    # with the number of cells and not with the number of respondents.
+
+    def __init__(self, dims, items):
+        self.dims = list(dims)
+        self.items = list(items)
+        self._cells = {}
+        self.counts = np.zeros((0, len(self.items), len(LEVELS) + 1), dtype=np.int32)
+        self.respondents = np.zeros(0, dtype=np.int32)
+
+    def add(self, A, codes=None):
+        # codes: int8 Likert codes of the items (computed if not given)
+        if codes is None:
+            codes = np.column_stack([likert_codes(A[c], strict=False) for c in self.items]
+                                    or [np.empty((len(A), 0), dtype=np.int8)])
+        if self.dims:
+            cell, uniques = pd.MultiIndex.from_frame(A[self.dims].astype(str)).factorize()
+            keys = list(uniques)
+        else:
+            cell, keys = np.zeros(len(A), dtype=np.intp), [()]
+        rows = np.array([self._cells.setdefault(tuple(k), len(self._cells)) for k in keys],
+                        dtype=np.intp)
+        grow = len(self._cells) - len(self.respondents)
+        if grow > 0:
+            self.counts = np.concatenate([self.counts, np.zeros((grow, *self.counts.shape[1:]),
+                                                                dtype=np.int32)])
+            self.respondents = np.concatenate([self.respondents, np.zeros(grow, dtype=np.int32)])
+        n_cells, n_items, n_codes = self.counts.shape
+        cell = rows[cell]
+        code = np.where(codes < 0, len(LEVELS), codes)
+        flat = (cell[:, None] * n_items + np.arange(n_items)) * n_codes + code
+        counts = np.bincount(flat.ravel(), minlength=n_cells * n_items * n_codes)
+        self.counts += counts.reshape(n_cells, n_items, n_codes).astype(np.int32)
+        self.respondents += np.bincount(cell, minlength=n_cells).astype(np.int32)
+
+    @classmethod
+    def from_cube(cls, cube):
+        builder = cls(cube.dims, cube.items)
+        builder._cells = {tuple(k): i for i, k in enumerate(cube.cells.tolist())}
+        builder.counts = cube.counts.astype(np.int32)
+        builder.respondents = cube.respondents.astype(np.int32)
+        return builder
+
+    def cube(self):
+        if self._cells:
+            cells = np.array(list(self._cells), dtype=str).reshape(len(self._cells), len(self.dims))
+        else:
+            cells = np.empty((0, len(self.dims)), dtype=str)
+        return AnswerCube(self.dims, cells, self.items, self.counts, self.respondents)
+
+
+class CubeState:
+    # Unsuppressed counts of every candidate item plus the value counts of
+    # the facet and item columns. Rows can be added at any time (chunks of
+    # an export, new responses of a partial export); the suppressed cube is
+    # derived from the totals, since what is rare depends on all the rows.
+
+    def __init__(self, dims, columns, builder=None, values=None):
+        self.dims = list(dims)
+        self.columns = list(columns)
+        self.builder = builder or CubeBuilder(self.dims, self.columns)
+        self.values = values or {}
+
+    @classmethod
+    def for_survey(cls, perfil, ano, pasta_dados='data'):
+        # Facets and candidate items of the export, read from its header
+        columns = survey_columns(perfil, ano, pasta_dados)
+        Q = load_questions(perfil, pasta_dados)
+        dims = [d for d in FACETS if d in columns]
+        items = [c for c in dict.fromkeys(Q['subquestions']) if c in columns and c not in dims]
+        return cls(dims, items)
+
+    def add(self, chunk):
+        chunk = chunk[self.dims + self.columns].fillna('')
+        self.values = count_values([chunk], counts=self.values)
+        self.builder.add(chunk)
+
+    def cube(self, n=1, thresholds=None):
+        rare = rare_values(self.values, n, thresholds)
+        raw = self.builder.cube()
+        # Likert items: every answer left after suppression is a Likert level
+        items = []
+        for j, c in enumerate(self.columns):
+            answered = set(self.values.get(c, {}).keys()) - rare.get(c, set()) - {''}
+            if answered and answered <= set(LEVELS):
+                items.append(j)
+        counts = raw.counts[:, items].copy()
+        for k, level in enumerate(LEVELS):
+            for i, j in enumerate(items):
+                if level in rare[self.columns[j]]:
+                    counts[:, i, -1] += counts[:, i, k]
+                    counts[:, i, k] = 0
+        cells = raw.cells.copy()
+        for d, dim in enumerate(self.dims):
+            cells[np.isin(cells[:, d], list(rare.get(dim, ()))), d] = ''
+        respondents = raw.respondents
+        if self.dims and len(cells):
+            # Cells that only differed by a suppressed value are merged
+            cell, uniques = pd.MultiIndex.from_arrays(list(cells.T)).factorize()
+            cells = np.array(list(uniques), dtype=str).reshape(len(uniques), len(self.dims))
+            merged = np.zeros((len(uniques), *counts.shape[1:]), dtype=np.int32)
+            np.add.at(merged, cell, counts)
+            counts = merged
+            respondents = np.bincount(cell, weights=respondents,
+                                      minlength=len(uniques)).astype(np.int32)
+        return AnswerCube(self.dims, cells, [self.columns[j] for j in items], counts, respondents)
+
+    def save(self, path, stamp):
+        values = {c: [[str(v), int(k)] for v, k in counts.items()]
+                  for c, counts in self.values.items()}
+        self.builder.cube().save(path, json.dumps([stamp, values]))
+
+    @classmethod
+    def load(cls, path):
+        raw, saved = AnswerCube.load(path)
+        stamp, values = json.loads(saved)
+        values = {c: pd.Series({v: k for v, k in pairs}, dtype=np.int64)
+                  for c, pairs in values.items()}
+        return cls(raw.dims, raw.items, CubeBuilder.from_cube(raw), values), stamp
+
+
+def stream_cube(perfil, ano, pasta_dados='data', chunksize=100_000, n=1, thresholds=None):
+    # Same cube as AnswerCube.from_frame(load_survey(...)) in a single pass
+    # over the export, holding one chunk at a time
+    state = CubeState.for_survey(perfil, ano, pasta_dados)
+    for chunk in read_survey_chunks(perfil, ano, pasta_dados, chunksize):
+        state.add(chunk)
+    return state.cube(n, thresholds)
+
+def streams(perfil, ano, pasta_dados='data'):
+    # Whether the export is too large to be loaded whole (STREAM_BYTES)
+    return os.path.getsize(data_path(perfil, ano, pasta_dados)) > STREAM_BYTES
+
+def _cube_stamp(perfil, ano, pasta_dados):
+    return json.dumps([file_stamp(data_path(perfil, ano, pasta_dados)),
+                       file_stamp(codebook_path(perfil, pasta_dados)),
+                       file_stamp(schema_path(perfil, ano, pasta_dados)),
+                       SNAPSHOT_VERSION, CUBE_VERSION])
+
+def _load_or_build(perfil, ano, pasta_dados):
+    path = cube_path(perfil, ano, pasta_dados)
+    stamp = _cube_stamp(perfil, ano, pasta_dados)
+    if os.path.exists(path):
+        try:
+            cube, saved = AnswerCube.load(path)
+            if saved == stamp:
+                return cube
+        except (OSError, ValueError, KeyError):
+            pass
+    if streams(perfil, ano, pasta_dados):
+        cube = stream_cube(perfil, ano, pasta_dados)
+    else:
+        A = load_survey(perfil, ano, pasta_dados)
+        Q = load_questions(perfil, pasta_dados)
+        cube = AnswerCube.from_frame(A, Q['subquestions'])
+    try:
+        cube.save(path, stamp)
+    except OSError:
+        pass
+    return cube
+
+def load_cube(perfil, ano, pasta_dados='data'):
+    # Cached in memory and on disk next to the export; rebuilt whenever the
+    # export, the codebook or the column schema changes.
+    return cached(f'cube-{perfil}', data_path(perfil, ano, pasta_dados),
+                  lambda path: _load_or_build(perfil, ano, pasta_dados),
+                  depends=(codebook_path(perfil, pasta_dados),
+                           schema_path(perfil, ano, pasta_dados)))
+
+def load_year_cubes(perfil, anos, pasta_dados='data', columns=None):
+    return YearCubes({ano: load_cube(perfil, ano, pasta_dados) for ano in anos}, columns)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Near-duplicate open answers (MinHash + LSH over character shingles) and
+# repeated submissions (rows with the same closed answers).
+#
+#   python dedup.py Estudantes 2024
+#
+# A respondent is flagged as a duplicate submission when an earlier row of
+# the same export has the same closed answers (at least MIN_ANSWERED of
+# them) and an open answer that is blank in both or near-identical.
+# Near-identical open answers alone ("NADA A DECLARAR") are only reported:
+# different respondents may well write the same thing.
+import sys
+import numpy as np
+import pandas as pd
+from ingestion import (OPEN_TEXT, cached, data_path, load_survey, read_survey_chunks,
+                       schema_path)
+from search import tokenize
+
+
+SHINGLE = 4
+NUM_PERM = 128
+BANDS = 16
+THRESHOLD = 0.8
+MIN_ANSWERED = 5
+
+_EMPTY = np.iinfo(np.uint32).max
+
+
+def shingles(text, k=SHINGLE):
+    # Character k-grams of the normalized text (accents, case and
+    # punctuation ignored)
+    text = ' '.join(tokenize(text))
+    return {text[i:i + k] for i in range(max(len(text) - k + 1, 1))} if text else set()
+
+def minhash(texts, num_perm=NUM_PERM, seed=0, block=2048):
+    # (n, num_perm) signatures from multiply-shift hashes of the 64-bit
+    # shingle hashes; a text without shingles gets _EMPTY everywhere
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, num_perm, dtype=np.uint64)[:, None] | np.uint64(1)
+    b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)[:, None]
+    signatures = np.full((len(texts), num_perm), _EMPTY, dtype=np.uint32)
+    for start in range(0, len(texts), block):
+        sets = [list(shingles(t)) for t in texts[start:start + block]]
+        sizes = np.array([len(s) for s in sets])
+        if not sizes.any():
+            continue
+        x = pd.util.hash_array(np.array([g for s in sets for g in s], dtype=object))
+        h = ((a * x + b) >> np.uint64(32)).astype(np.uint32)
+        docs = np.flatnonzero(sizes)
+        starts = np.concatenate([[0], np.cumsum(sizes)])[docs]
+        signatures[start + docs] = np.minimum.reduceat(h, starts, axis=1).T
+    return signatures
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def near_duplicates(texts, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS, seed=0):
+    # Cluster label per text (the first text of its cluster), -1 when it has
+    # no near-duplicate. Candidates share a band of their signatures; each is
+    # checked against the first member of its bucket only, so the work grows
+    # with n * bands and not with the number of pairs.
+    signatures = minhash(texts, num_perm, seed)
+    valid = np.flatnonzero((signatures != _EMPTY).any(axis=1))
+    parent = np.arange(len(texts))
+    rows = num_perm // bands
+    for band in range(bands if len(valid) > 1 else 0):
+        keys = pd.util.hash_pandas_object(
+            pd.DataFrame(signatures[valid, band * rows:(band + 1) * rows]), index=False).to_numpy()
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        new_bucket = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+        heads = valid[order][np.maximum.accumulate(np.where(new_bucket, np.arange(len(order)), 0))]
+        members = valid[order]
+        pairs = heads != members
+        heads, members = heads[pairs], members[pairs]
+        similar = (signatures[heads] == signatures[members]).mean(axis=1) >= threshold
+        for i, j in zip(heads[similar], members[similar]):
+            ri, rj = _find(parent, i), _find(parent, j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+    roots = np.array([_find(parent, i) for i in range(len(texts))], dtype=np.int64)
+    sizes = np.bincount(roots, minlength=len(texts))
+    return np.where(sizes[roots] > 1, roots, -1)
+
+def repeated_rows(A, min_answered=MIN_ANSWERED):
+    # Group label per row (its first occurrence) for rows repeating the
+    # values of an earlier row with at least `min_answered` answers; -1 else
+    keys = pd.util.hash_pandas_object(A, index=False).to_numpy()
+    answered = (A != '').sum(axis=1).to_numpy() >= min_answered
+    first = pd.Series(np.arange(len(A))).groupby(keys).transform('min').to_numpy()
+    sizes = pd.Series(keys).map(pd.Series(keys).value_counts()).to_numpy()
+    return np.where(answered & (sizes > 1), first, -1)
+
+
+def find_duplicates(perfil, ano, pasta_dados='data'):
+    # One row per respondent of load_survey(perfil, ano): the near-duplicate
+    # cluster of the open answer, the group of identical closed answers and
+    # whether the row is a repeated submission of an earlier one
+    A = load_survey(perfil, ano, pasta_dados)
+    text = pd.concat(list(read_survey_chunks(perfil, ano, pasta_dados, columns=OPEN_TEXT)))
+    text = (text.iloc[:, 0] if text.shape[1] else pd.Series('', index=A.index)).fillna('')
+    text = text.str.strip().to_numpy(dtype=object)
+    grupo_texto = near_duplicates(text)
+    closed = [c for c in A.columns if c not in OPEN_TEXT]
+    grupo_respostas = repeated_rows(A[closed])
+    # Same closed answers and blank or near-identical open answers
+    same_text = np.where(text == '', -2, np.where(grupo_texto >= 0, grupo_texto,
+                                                  np.arange(len(A)) + len(A)))
+    key = pd.Series(list(zip(grupo_respostas, same_text)))
+    duplicata = (grupo_respostas >= 0) & key.duplicated().to_numpy()
+    return pd.DataFrame({'grupo_texto': grupo_texto, 'grupo_respostas': grupo_respostas,
+                         'duplicata': duplicata}, index=A.index)
+
+def load_duplicates(perfil, ano, pasta_dados='data'):
+    return cached(f'duplicatas-{perfil}', data_path(perfil, ano, pasta_dados),
+                  lambda path: find_duplicates(perfil, ano, pasta_dados),
+                  depends=(schema_path(perfil, ano, pasta_dados),))
+
+def duplicate_report(perfil, ano, pasta_dados='data'):
+    # (near-duplicate open answer clusters, repeated submissions)
+    D = load_duplicates(perfil, ano, pasta_dados)
+    text = pd.concat(list(read_survey_chunks(perfil, ano, pasta_dados, columns=OPEN_TEXT)))
+    text = (text.iloc[:, 0] if text.shape[1] else pd.Series('', index=D.index)).fillna('').str.strip()
+    clusters = (pd.DataFrame({'grupo': D['grupo_texto'], 'resposta': text.to_numpy()})
+                .query('grupo >= 0').groupby('grupo')
+                .agg(respostas=('resposta', 'size'), exemplo=('resposta', 'first'))
+                .sort_values('respostas', ascending=False))
+    submissions = (D[D['grupo_respostas'] >= 0].reset_index()
+                   .groupby('grupo_respostas')
+                   .agg(linhas=('index', list), duplicatas=('duplicata', 'sum')))
+    return clusters, submissions
+
+
+if __name__ == "__main__":
+    perfil, ano = sys.argv[1], sys.argv[2]
+    clusters, submissions = duplicate_report(perfil, ano)
+    pd.set_option('display.max_colwidth', 80)
+    print(f'{len(clusters)} grupos de comentários quase idênticos')
+    print(clusters.to_string())
+    print(f'\n{len(submissions)} grupos de respostas fechadas idênticas, '
+          f'{int(submissions["duplicatas"].sum())} submissões repetidas')
+    print(submissions.to_string())
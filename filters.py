@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import copy
+import numpy as np
+import pandas as pd
+from ingestion import cached, codebook_path, data_path, load_survey, schema_path
+from cube import load_cube
+
+
+# A selection of this many respondents or fewer is never shown, in any view
+SINGLE = 1
+
+def suppress_single(n):
+    # Respondents (a count or an array of counts) with those of selections
+    # too small to show set to 0
+    return n * (n > SINGLE)
+
+class FilterIndex:
+    # One boolean mask per (column, value) of the filter columns, stored as a
+    # one-hot matrix per column. A selection is OR within a column and AND
+    # across columns, so it resolves to a few vectorized mask operations.
+    # `weights` gives the respondents each row stands for (e.g. the cells of
+    # an AnswerCube), one each by default.
+
+    def __init__(self, A, columns, weights=None):
+        self.n = len(A)
+        self.weights = None if weights is None else np.asarray(weights)
+        self.values = {}
+        self.masks = {}
+        for column in columns:
+            codes, uniques = pd.factorize(A[column])
+            onehot = np.zeros((len(uniques), self.n), dtype=bool)
+            answered = codes >= 0
+            onehot[codes[answered], np.flatnonzero(answered)] = True
+            self.values[column] = {v: i for i, v in enumerate(uniques)}
+            self.masks[column] = onehot
+
+    def options(self, column):
+        # Values in order of appearance, as A[column].unique()
+        return list(self.values[column])
+
+    def mask(self, column, values):
+        positions = [self.values[column][v] for v in values if v in self.values[column]]
+        return self.masks[column][positions].any(axis=0)
+
+    def select(self, selection):
+        # selection: {column: [values]}; columns with no values are ignored
+        mask = np.ones(self.n, dtype=bool)
+        for column, values in selection.items():
+            if len(values) > 0:
+                mask &= self.mask(column, values)
+        return mask
+
+    def counts(self, selection, column):
+        # Respondents per option of `column` under the selection made on the
+        # other columns, i.e. how many would remain if the option was picked
+        others = {c: v for c, v in selection.items() if c != column}
+        masks = self.masks[column] & self.select(others)
+        if self.weights is None:
+            counts = np.count_nonzero(masks, axis=1)
+        else:
+            counts = masks @ self.weights
+        return dict(zip(self.values[column], counts.tolist()))
+
+    def weighted(self, weights):
+        # The same index counting `weights` respondents per row (e.g. 0 for
+        # the repeated submissions); the masks are shared
+        index = copy.copy(self)
+        index.weights = np.asarray(weights, dtype=np.int64)
+        return index
+
+    def total(self, mask):
+        # Respondents in the rows of a selection mask
+        if self.weights is None:
+            return int(np.count_nonzero(mask))
+        return int(self.weights[mask].sum())
+
+
+def load_filters(perfil, ano, columns, pasta_dados='data', cells=False):
+    # FilterIndex of `columns` over the respondents of one export, in the
+    # row order of load_survey, cached with it. With cells, over the cells of
+    # its AnswerCube instead, each weighted by its respondents.
+    path = data_path(perfil, ano, pasta_dados)
+    depends = (schema_path(perfil, ano, pasta_dados),)
+    if cells:
+        def build(path):
+            cube = load_cube(perfil, ano, pasta_dados)
+            return FilterIndex(pd.DataFrame(cube.cells, columns=cube.dims), columns,
+                               cube.respondents)
+        return cached(f'filtros-celulas-{perfil}-{"|".join(columns)}', path, build,
+                      depends=depends + (codebook_path(perfil, pasta_dados),))
+    return cached(f'filtros-{perfil}-{"|".join(columns)}', path,
+                  lambda path: FilterIndex(load_survey(perfil, ano, pasta_dados, columns=columns),
+                                           columns),
+                  depends=depends)
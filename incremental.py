@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Incremental ingestion of partial exports while the survey is open. Only
+# the responses not yet in data/{ano}/{perfil}_dados_{ano}.csv are appended,
+# and the answer cube is updated from them instead of being rebuilt.
+#
+#   python incremental.py Estudantes 2025 Parcial_estudantes_09_02.csv
+#
+# Responses are matched by the LimeSurvey response ID when the export has
+# one (column `id`), otherwise by a hash of the whole row. Identical rows
+# are counted, so two respondents with the same answers are both kept.
+import os
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from ingestion import apply_schema, data_path, invalidate
+from cube import CubeState, _cube_stamp, cube_path
+
+
+def keys_path(perfil, ano, pasta_dados='data'):
+    return os.path.join(pasta_dados, str(ano), f'{perfil}_chaves_{ano}.npy')
+
+def state_path(perfil, ano, pasta_dados='data'):
+    return os.path.join(pasta_dados, str(ano), f'{perfil}_estado_{ano}.npz')
+
+def _read_chunks(path, chunksize):
+    return pd.read_csv(path, sep=';', keep_default_na=False, dtype=str, chunksize=chunksize)
+
+def row_keys(chunk, key='id'):
+    # uint64 per row: the response ID, or a hash of the row's values
+    if key in chunk.columns:
+        return pd.util.hash_array(chunk[key].to_numpy(dtype=object))
+    return pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+def stored_state(perfil, ano, pasta_dados='data', key='id', chunksize=100_000):
+    # (row keys, CubeState) of the stored export, from the files kept next to
+    # it; rebuilt in one pass over the export when they are missing or stale
+    stamp = _cube_stamp(perfil, ano, pasta_dados)
+    try:
+        state, saved = CubeState.load(state_path(perfil, ano, pasta_dados))
+        keys = np.load(keys_path(perfil, ano, pasta_dados))
+        if saved == stamp and len(keys) == state.builder.respondents.sum():
+            return keys, state
+    except (OSError, ValueError, KeyError):
+        pass
+    state = CubeState.for_survey(perfil, ano, pasta_dados)
+    keys = [np.empty(0, dtype=np.uint64)]
+    with _read_chunks(data_path(perfil, ano, pasta_dados), chunksize) as reader:
+        for chunk in reader:
+            keys.append(row_keys(chunk, key))
+            state.add(apply_schema(chunk, perfil, ano, pasta_dados))
+    return np.concatenate(keys), state
+
+def _save(perfil, ano, pasta_dados, keys, state):
+    # The cube is saved with the stamp of the updated export, so load_cube
+    # uses it as is
+    stamp = _cube_stamp(perfil, ano, pasta_dados)
+    path = keys_path(perfil, ano, pasta_dados)
+    np.save(path + '.tmp.npy', keys)
+    os.replace(path + '.tmp.npy', path)
+    state.save(state_path(perfil, ano, pasta_dados), stamp)
+    state.cube().save(cube_path(perfil, ano, pasta_dados), stamp)
+    invalidate(data_path(perfil, ano, pasta_dados))
+
+def append_export(perfil, ano, export_path, pasta_dados='data', key='id', chunksize=100_000):
+    # Appends the new responses of `export_path` to the stored export and
+    # returns how many there were
+    path = data_path(perfil, ano, pasta_dados)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(export_path, path)
+        keys, state = stored_state(perfil, ano, pasta_dados, key, chunksize)
+        _save(perfil, ano, pasta_dados, keys, state)
+        return len(keys)
+
+    keys, state = stored_state(perfil, ano, pasta_dados, key, chunksize)
+    header = list(pd.read_csv(path, sep=';', nrows=0).columns)
+    stored = pd.Series(keys).value_counts()
+    seen = pd.Series(dtype=np.int64)
+    added = []
+    with open(path, 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        newline = file.read(1) != b'\n'
+    with _read_chunks(export_path, chunksize) as reader:
+        for chunk in reader:
+            if set(chunk.columns) != set(header):
+                raise ValueError(f'{export_path}: colunas diferentes de {path}')
+            chunk = chunk[header]
+            h = pd.Series(row_keys(chunk, key), index=chunk.index)
+            # The k-th occurrence of a key is new when fewer than k are stored
+            rank = h.groupby(h).cumcount().to_numpy() + seen.reindex(h).fillna(0).to_numpy()
+            new = rank >= stored.reindex(h).fillna(0).to_numpy()
+            seen = seen.add(h.value_counts(), fill_value=0)
+            if not new.any():
+                continue
+            with open(path, 'a', encoding='utf-8', newline='') as file:
+                if newline:
+                    file.write('\n')
+                    newline = False
+                chunk[new].to_csv(file, sep=';', index=False, header=False)
+            state.add(apply_schema(chunk[new], perfil, ano, pasta_dados))
+            added.append(h.to_numpy()[new])
+    if added:
+        keys = np.concatenate([keys, *added])
+        _save(perfil, ano, pasta_dados, keys, state)
+    return sum(len(a) for a in added)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Acrescenta as respostas novas de uma exportação parcial')
+    parser.add_argument('perfil')
+    parser.add_argument('ano')
+    parser.add_argument('exportacao', help='CSV exportado do LimeSurvey (separado por ;)')
+    parser.add_argument('--data', default='data', help='pasta com os dados por ano')
+    parser.add_argument('--chave', default='id', help='coluna com o ID da resposta')
+    args = parser.parse_args()
+    n = append_export(args.perfil, args.ano, args.exportacao, args.data, args.chave)
+    keys, _ = stored_state(args.perfil, args.ano, args.data, args.chave)
+    print(f'{n} respostas novas, {len(keys)} no total')
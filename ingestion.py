@@ -0,0 +1,349 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-  
+import numpy as np
+import pandas as pd
+import os
+import json
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.parquet as pq
+from profiling import carry, span
+from codebook import compile_codebook
+
+def extract_questions_and_subquestions(file_path):
+    # {question_id: {'text', 'subquestions': [{'id', 'text'}]}}
+    return compile_codebook(file_path).tree()
+
+def transform_questions_to_dataframe(questions):
+    
+    Q=[]
+    # Print the extracted questions and subquestions
+    for question_id, question_data in questions.items():
+        if len(question_data['subquestions'])==0:
+            q={}
+            q['question_id']=question_id
+            q['question_data']=question_data['text']
+            q['subquestions'] = question_id#f"{question_id}"
+            q['text'] = question_data['text']
+            Q.append(q)
+        else:
+            for subquestion in question_data['subquestions']:
+                q={}
+                q['question_id']=question_id
+                q['question_data']=question_data['text']
+                q['subquestions'] = subquestion['id']
+                q['subquestions'] = f"{question_id}[{subquestion['id']}]"
+                q['text'] = subquestion['text']
+                Q.append(q)
+               
+           
+        
+    Q = pd.DataFrame(Q)
+    return Q
+
+
+# Identification columns (demographic facets) and free-text columns, so the
+# rare-value suppression can use a different threshold for each kind.
+FACETS = ['Perfil', 'Campus', 'Unidade', 'LOTACAO']
+OPEN_TEXT = ['Qaberta', 'ABERTA']
+
+def column_kind(column):
+    if column in FACETS:
+        return 'facet'
+    if column in OPEN_TEXT:
+        return 'text'
+    return 'item'
+
+def _rare_values(values, threshold):
+    # Factorize once and count codes with bincount; missing values get code -1.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    rare = (counts > 0) & (counts <= threshold)
+    mask = np.append(rare, False)[codes]  # code -1 picks the trailing False
+    return mask, uniques[rare], counts[rare]
+
+def _threshold(column, n, thresholds):
+    # `thresholds` may name single columns or a kind ('facet', 'item', 'text')
+    if not thresholds:
+        return n
+    return thresholds.get(column, thresholds.get(column_kind(column), n))
+
+def suppression_report(df, n=1, thresholds=None):
+    report = []
+    for column in df.columns:
+        _, values, counts = _rare_values(df[column], _threshold(column, n, thresholds))
+        report += [(column, v, c) for v, c in zip(values, counts)]
+    return pd.DataFrame(report, columns=['column', 'value', 'count'])
+
+def remove_single_occurrences(df, n=1, thresholds=None):
+    # Values answered by at most `n` respondents of a column are blanked (None)
+    columns = {}
+    for column in df.columns:
+        mask, _, _ = _rare_values(df[column], _threshold(column, n, thresholds))
+        values = df[column]
+        if mask.any():
+            # infer_objects gives the dtypes of the former per-cell apply
+            # (e.g. an int column with blanked values becomes float)
+            values = values.astype(object).where(~mask, None).infer_objects()
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def count_values(chunks, columns=None, counts=None):
+    # Per-column value counts accumulated chunk by chunk (blank answers are
+    # a value too); only the distinct values are kept, never the rows.
+    # `counts` continues a previous accumulation.
+    counts = {} if counts is None else dict(counts)
+    for chunk in chunks:
+        for column in (chunk.columns if columns is None else columns):
+            c = chunk[column].value_counts()
+            counts[column] = c if column not in counts else counts[column].add(c, fill_value=0)
+    return counts
+
+def rare_values(counts, n=1, thresholds=None):
+    # {column: values to blank}, the same rule as remove_single_occurrences
+    return {column: set(c.index[(c > 0) & (c <= _threshold(column, n, thresholds))])
+            for column, c in counts.items()}
+
+# Função para listar as pastas (anos) dentro da pasta 'data'
+def listar_anos(diretorio):
+    # Obtém a lista de pastas dentro da pasta 'data'
+    anos = [pasta for pasta in os.listdir(diretorio) if os.path.isdir(os.path.join(diretorio, pasta))]
+    return sorted(anos)  # Ordena os anos de forma crescente
+
+
+def long_responses(A, Q):
+    # Tidy table with one row per (respondent, subquestion) and the answer
+    # in `data`, joined with the question texts from Q.
+    Q = Q[Q['subquestions'].isin(A.columns)]
+    L = A[list(Q['subquestions'])].astype(object).rename_axis('respondent').reset_index()
+    L = L.melt(id_vars='respondent', var_name='subquestions', value_name='data')
+    return L.merge(Q, on='subquestions', how='left')
+
+
+# Cache shared by every session of the running process. Entries are keyed by
+# the absolute path of the source file and carry the (mtime, size) stamp seen
+# when they were loaded, so an edited file is re-read on the next access.
+_cache = {}
+_cache_lock = threading.RLock()
+_key_locks = {}
+
+PERFIS = ['Estudantes', 'Servidores']
+
+
+def codebook_path(perfil, pasta_dados='data'):
+    return os.path.join(pasta_dados, '2024', f'Códigos_{perfil}.csv')
+
+def data_path(perfil, ano, pasta_dados='data'):
+    return os.path.join(pasta_dados, str(ano), f'{perfil}_dados_{ano}.csv')
+
+def _year_key(ano):
+    return (0, int(ano), '') if str(ano).isdigit() else (1, 0, str(ano))
+
+def schema_path(perfil, ano, pasta_dados='data'):
+    # {perfil}_esquema_{ano}.csv maps each export column of the cycle to its
+    # canonical name. A cycle without its own file uses the latest earlier
+    # one (or the latest of all, e.g. for synthetic exports).
+    def path(a):
+        return os.path.join(pasta_dados, str(a), f'{perfil}_esquema_{a}.csv')
+    if os.path.exists(path(ano)):
+        return path(ano)
+    anos = sorted((a for a in listar_anos(pasta_dados) if os.path.exists(path(a))), key=_year_key)
+    if not anos:
+        raise FileNotFoundError(f'Nenhum esquema de colunas para {perfil} em {pasta_dados}')
+    earlier = [a for a in anos if _year_key(a) <= _year_key(ano)]
+    return path((earlier or anos)[-1])
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def cached(kind, path, loader, depends=()):
+    # `depends` lists further files whose changes also invalidate the entry
+    key = (kind, os.path.abspath(path))
+    stamp = tuple(file_stamp(p) for p in (path, *depends))
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    # Only one thread loads a given file; different files load concurrently
+    with key_lock:
+        with _cache_lock:
+            entry = _cache.get(key)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, loader(path))
+            with _cache_lock:
+                _cache[key] = entry
+    return entry[1]
+
+def read_schema(path):
+    return pd.read_csv(path, sep=';', keep_default_na=False, dtype=str)
+
+def load_schema(perfil, ano, pasta_dados='data'):
+    return cached('schema', schema_path(perfil, ano, pasta_dados), read_schema)
+
+def apply_schema(A, perfil, ano, pasta_dados='data'):
+    # Single rename + assign: export columns get their canonical names and
+    # canonical columns not asked in this cycle are created blank ('') at once.
+    # Columns missing from the schema are kept as they are and reported.
+    schema = load_schema(perfil, ano, pasta_dados)
+    mapped = schema[schema['exportacao'] != '']
+    mapping = dict(zip(mapped['exportacao'], mapped['coluna']))
+    unknown = [c for c in A.columns if c not in mapping]
+    absent = [c for c in mapping if c not in A.columns]
+    if unknown:
+        warnings.warn(f'{perfil} {ano}: colunas fora do esquema: {unknown}')
+    if absent:
+        warnings.warn(f'{perfil} {ano}: colunas do esquema ausentes na exportação: {absent}')
+    B = A.rename(columns=mapping)
+    B = B.loc[:, ~B.columns.duplicated(keep='last')]
+    extra = [c for c in pd.unique(schema['coluna']) if c not in B.columns]
+    return B.assign(**{c: '' for c in extra})
+
+def invalidate(path=None):
+    # Drop cached entries for a single source file, or everything if no path.
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+            return
+        path = os.path.abspath(path)
+        for key in [k for k in _cache if k[1] == path]:
+            del _cache[key]
+
+# Columnar snapshots live next to the CSV export and record the stamp of the
+# files they were built from (export and column schema). Bump
+# SNAPSHOT_VERSION whenever the suppression rules change so existing
+# snapshots are rebuilt.
+SNAPSHOT_VERSION = 1
+
+def snapshot_path(perfil, ano, pasta_dados='data'):
+    return os.path.join(pasta_dados, str(ano), f'{perfil}_dados_{ano}.parquet')
+
+def read_csv_survey(perfil, ano, pasta_dados='data'):
+    with span('csv_load'):
+        # Read as text, like read_survey_chunks: a numeric column (e.g.
+        # lastpage) with a blanked rare value would mix ints and '' and
+        # could not be stored as a categorical snapshot
+        A = pd.read_csv(data_path(perfil, ano, pasta_dados), sep=';', keep_default_na=False,
+                        dtype=str)
+    with span('remap'):
+        A = apply_schema(A, perfil, ano, pasta_dados)
+    with span('suppress'):
+        A = remove_single_occurrences(A)
+        A.fillna('', inplace=True)
+    return A
+
+def survey_columns(perfil, ano, pasta_dados='data'):
+    # Canonical columns of an export, from its header only
+    header = pd.read_csv(data_path(perfil, ano, pasta_dados), sep=';', nrows=0)
+    return list(apply_schema(header, perfil, ano, pasta_dados).columns)
+
+def read_survey_chunks(perfil, ano, pasta_dados='data', chunksize=100_000, columns=None):
+    # Streams the export with the column schema applied, `chunksize` rows at
+    # a time and restricted to `columns` (when given and present). Rare
+    # values are not suppressed: that needs the counts of the whole file.
+    path = data_path(perfil, ano, pasta_dados)
+    with pd.read_csv(path, sep=';', keep_default_na=False, dtype=str,
+                     chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = apply_schema(chunk, perfil, ano, pasta_dados)
+            if columns is not None:
+                chunk = chunk[[c for c in columns if c in chunk.columns]]
+            yield chunk
+
+def _snapshot_stamp(source_path, depends=()):
+    stamps = [file_stamp(p) for p in (source_path, *depends)]
+    return json.dumps([*stamps, SNAPSHOT_VERSION]).encode()
+
+def write_snapshot(A, source_path, snap_path, depends=()):
+    table = pa.Table.from_pandas(A.astype('category'), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'cpa_source_stamp'] = _snapshot_stamp(source_path, depends)
+    table = table.replace_schema_metadata(metadata)
+    tmp_path = snap_path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, snap_path)
+
+def snapshot_is_fresh(source_path, snap_path, depends=()):
+    if not os.path.exists(snap_path):
+        return False
+    metadata = pq.read_schema(snap_path).metadata or {}
+    return metadata.get(b'cpa_source_stamp') == _snapshot_stamp(source_path, depends)
+
+def build_snapshot(perfil, ano, pasta_dados='data'):
+    path = data_path(perfil, ano, pasta_dados)
+    A = read_csv_survey(perfil, ano, pasta_dados)
+    write_snapshot(A, path, snapshot_path(perfil, ano, pasta_dados),
+                   (schema_path(perfil, ano, pasta_dados),))
+    return A
+
+def load_snapshot(perfil, ano, columns=None, pasta_dados='data'):
+    # Normalized export with categorical columns, reading only `columns`
+    # when given. A missing or stale snapshot falls back to the CSV and is
+    # rebuilt on the way (best effort, the data folder may be read-only).
+    path = data_path(perfil, ano, pasta_dados)
+    snap_path = snapshot_path(perfil, ano, pasta_dados)
+    depends = (schema_path(perfil, ano, pasta_dados),)
+    if snapshot_is_fresh(path, snap_path, depends):
+        with span('snapshot_load'):
+            return pq.read_table(snap_path, columns=columns).to_pandas()
+    A = read_csv_survey(perfil, ano, pasta_dados)
+    try:
+        write_snapshot(A, path, snap_path, depends)
+    except (OSError, pa.ArrowException):
+        pass
+    A = A.astype('category')
+    return A if columns is None else A[columns]
+
+def load_codebook(perfil, pasta_dados='data'):
+    # Compiled once per codebook file and shared; treat it as read-only
+    return cached('codebook', codebook_path(perfil, pasta_dados), compile_codebook)
+
+def load_questions(perfil, pasta_dados='data'):
+    return load_codebook(perfil, pasta_dados).frame()
+
+def load_survey(perfil, ano, pasta_dados='data', columns=None):
+    # Normalized export (renamed columns, rare values suppressed, no NaN) with
+    # categorical columns, restricted to `columns` (when given and present).
+    # The cached frame is shared, not copied: treat the values as read-only.
+    A = cached(f'survey-{perfil}', data_path(perfil, ano, pasta_dados),
+               lambda path: load_snapshot(perfil, ano, pasta_dados=pasta_dados),
+               depends=(schema_path(perfil, ano, pasta_dados),))
+    if columns is None:
+        return A.copy(deep=False)
+    return A[[c for c in columns if c in A.columns]]
+
+def filter_columns(perfil, ano, pasta_dados='data'):
+    # The two filters of Resultados and Dados: the first two columns of the
+    # export once Unidade and LOTACAO are left out. Taken from the header,
+    # so exports too large to be loaded have them too.
+    columns = cached(f'colunas-{perfil}', data_path(perfil, ano, pasta_dados),
+                     lambda path: survey_columns(perfil, ano, pasta_dados),
+                     depends=(schema_path(perfil, ano, pasta_dados),))
+    return sorted(pd.Index(columns).drop(['Unidade', 'LOTACAO'], errors='ignore')[:2])
+
+def load_years(perfil, anos, pasta_dados='data', max_workers=None):
+    # Loads the years concurrently and concatenates them once, with the
+    # year in an 'Ano' column. Columns missing in a year are left blank.
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(carry(lambda ano: load_survey(perfil, ano, pasta_dados).astype(object)),
+                               anos))
+    for ano, A in zip(anos, frames):
+        A['Ano'] = ano
+    return pd.concat(frames, ignore_index=True).fillna('')
+
+
+if __name__ == "__main__":
+    # python ingestion.py [pasta_dados] -> (re)build every columnar snapshot
+    import sys
+    pasta_dados = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    for ano in listar_anos(pasta_dados):
+        for perfil in PERFIS:
+            if os.path.exists(data_path(perfil, ano, pasta_dados)):
+                build_snapshot(perfil, ano, pasta_dados)
+                print(snapshot_path(perfil, ano, pasta_dados))
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# On-disk result cache (SQLite) that survives restarts. Results are stored
+# under the content hash of what they are computed from: the exports and
+# column schemas of the years involved, the codebook and the scoring scheme.
+# An edited export gets a new hash, so its old results are never read and
+# are dropped by `podar`.
+#
+#   python persistence.py aquecer      precompute the default views
+#   python persistence.py podar        drop results of replaced sources
+#   python persistence.py verificar    integrity check of every entry
+import os
+import sys
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import argparse
+import threading
+from itertools import product
+from ingestion import (PERFIS, SNAPSHOT_VERSION, codebook_path, data_path, file_stamp,
+                       filter_columns, listar_anos, load_questions, load_years, schema_path)
+from satisfaction import (BOOTSTRAP_LEVEL, BOOTSTRAP_RESAMPLES, BOOTSTRAP_SEED, LEVELS, SCORES,
+                          SatisfactionEngine, load_engine)
+from significance import year_changes
+from filters import load_filters, suppress_single
+from cube import CUBE_VERSION, load_cube, load_year_cubes, streams
+import dedup
+
+
+# Bump when the stored results change meaning or layout
+STORE_VERSION = 1
+
+# Part of every source hash: results are invalid once the scores, the
+# snapshots, the cubes or the duplicate detection change
+SCORING = hashlib.sha256(json.dumps(
+    [STORE_VERSION, LEVELS, SCORES.tolist(), BOOTSTRAP_RESAMPLES, BOOTSTRAP_LEVEL,
+     SNAPSHOT_VERSION, CUBE_VERSION,
+     [dedup.SHINGLE, dedup.NUM_PERM, dedup.BANDS, dedup.THRESHOLD, dedup.MIN_ANSWERED]]
+).encode('utf-8')).hexdigest()
+
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def store_path(pasta_dados='data'):
+    return os.path.join(pasta_dados, 'resultados.sqlite')
+
+def _connect(pasta_dados):
+    db = sqlite3.connect(store_path(pasta_dados), timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS resultados (fonte TEXT, chave TEXT, valor BLOB, '
+               'sha256 TEXT, criado REAL, PRIMARY KEY (fonte, chave))')
+    db.execute('CREATE TABLE IF NOT EXISTS fontes (caminho TEXT PRIMARY KEY, mtime_ns INTEGER, '
+               'tamanho INTEGER, sha256 TEXT)')
+    return db
+
+def file_hash(path, db=None):
+    # sha256 of a file's content; recomputed only when its (mtime, size)
+    # stamp changes, remembered in memory and in the fontes table
+    stamp = file_stamp(path)
+    key = os.path.abspath(path)
+    with _hashes_lock:
+        known = _hashes.get(key)
+    if known is not None and known[0] == stamp:
+        return known[1]
+    row = None
+    if db is not None:
+        row = db.execute('SELECT sha256 FROM fontes WHERE caminho = ? AND mtime_ns = ? '
+                         'AND tamanho = ?', (key, *stamp)).fetchone()
+    if row is not None:
+        digest = row[0]
+    else:
+        h = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        if db is not None:
+            with db:
+                db.execute('INSERT OR REPLACE INTO fontes VALUES (?, ?, ?, ?)', (key, *stamp, digest))
+    with _hashes_lock:
+        _hashes[key] = (stamp, digest)
+    return digest
+
+def source_paths(perfil, anos, pasta_dados='data'):
+    # The files a result of (perfil, anos) is computed from
+    paths = [codebook_path(perfil, pasta_dados)]
+    for ano in sorted(anos):
+        paths += [data_path(perfil, ano, pasta_dados), schema_path(perfil, ano, pasta_dados)]
+    return paths
+
+def source_hash(perfil, anos, pasta_dados='data', db=None):
+    # Hash of everything a result of (perfil, anos) is computed from
+    parts = [SCORING] + [file_hash(p, db) for p in source_paths(perfil, anos, pasta_dados)]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+def stored_result(perfil, anos, key, build, pasta_dados='data'):
+    # The result stored for `key` (any repr-stable tuple) and the current
+    # sources, or build() stored. An entry whose checksum does not match or
+    # that does not unpickle is dropped and rebuilt; a store that cannot be
+    # used is bypassed.
+    chave = repr(key)
+    try:
+        db = _connect(pasta_dados)
+    except sqlite3.Error:
+        return build()
+    try:
+        fonte = source_hash(perfil, anos, pasta_dados, db)
+        row = db.execute('SELECT valor, sha256 FROM resultados WHERE fonte = ? AND chave = ?',
+                         (fonte, chave)).fetchone()
+        if row is not None:
+            if hashlib.sha256(row[0]).hexdigest() == row[1]:
+                try:
+                    return pickle.loads(row[0])
+                except Exception:
+                    pass
+            with db:
+                db.execute('DELETE FROM resultados WHERE fonte = ? AND chave = ?', (fonte, chave))
+        value = build()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with db:
+            db.execute('INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?)',
+                       (fonte, chave, blob, hashlib.sha256(blob).hexdigest(), time.time()))
+        return value
+    except sqlite3.Error:
+        return build()
+    finally:
+        db.close()
+
+
+def current_sources(pasta_dados='data', db=None):
+    # (source hashes results can be stored under today, the files hashed):
+    # every (perfil, ano) and every perfil over all of its years (Comparação)
+    fontes, paths = set(), set()
+    for perfil in PERFIS:
+        anos = [ano for ano in listar_anos(pasta_dados)
+                if os.path.exists(data_path(perfil, ano, pasta_dados))]
+        for ano in anos:
+            fontes.add(source_hash(perfil, [ano], pasta_dados, db))
+        if anos:
+            fontes.add(source_hash(perfil, anos, pasta_dados, db))
+            paths.update(os.path.abspath(p) for p in source_paths(perfil, anos, pasta_dados))
+    return fontes, paths
+
+def prune(pasta_dados='data'):
+    # Drops the results of sources that no longer exist; returns how many
+    db = _connect(pasta_dados)
+    try:
+        fontes, paths = current_sources(pasta_dados, db)
+        stored = {f for (f,) in db.execute('SELECT DISTINCT fonte FROM resultados')}
+        removed = 0
+        with db:
+            for fonte in stored - fontes:
+                removed += db.execute('DELETE FROM resultados WHERE fonte = ?', (fonte,)).rowcount
+            if paths:
+                db.execute('DELETE FROM fontes WHERE caminho NOT IN (%s)' % ','.join('?' * len(paths)),
+                           list(paths))
+        db.execute('VACUUM')
+        return removed
+    finally:
+        db.close()
+
+def verify(pasta_dados='data'):
+    # (SQLite integrity check, entries dropped for a wrong checksum)
+    db = _connect(pasta_dados)
+    try:
+        check = db.execute('PRAGMA integrity_check').fetchone()[0]
+        bad = [(f, c) for f, c, valor, sha in
+               db.execute('SELECT fonte, chave, valor, sha256 FROM resultados')
+               if hashlib.sha256(valor).hexdigest() != sha]
+        with db:
+            db.executemany('DELETE FROM resultados WHERE fonte = ? AND chave = ?', bad)
+        return check, len(bad)
+    finally:
+        db.close()
+
+
+def warm_up(pasta_dados='data'):
+    # Fills the store with the views every visitor starts from, computed as
+    # in the dashboard: Resultados for every single-value selection of its
+    # two filters (and none), and Comparação, all without the duplicate
+    # filter. Returns how many results were computed or found.
+    from results import cached_result  # results.py reads through this store
+    n = 0
+    for perfil in PERFIS:
+        anos = [ano for ano in listar_anos(pasta_dados)
+                if os.path.exists(data_path(perfil, ano, pasta_dados))]
+        for ano in anos:
+            # As in Resultados, large exports from the cube and without intervals
+            cols = filter_columns(perfil, ano, pasta_dados)
+            cube = load_cube(perfil, ano, pasta_dados)
+            grande = streams(perfil, ano, pasta_dados)
+            if grande:
+                cols = [c for c in cols if c in cube.dims]
+            index = load_filters(perfil, ano, cols, pasta_dados, cells=grande)
+            if not grande:
+                engine = load_engine(perfil, ano, pasta_dados)
+            values = [[None] + [v for v in index.options(c) if v != ''] for c in cols]
+            for combo in product(*values):
+                keys = {c: [v] for c, v in zip(cols, combo) if v is not None}
+                rows = index.select(keys)
+                respondentes = suppress_single(index.total(rows))
+                if not respondentes:
+                    rows[:] = False
+                cached_result(perfil, ano, keys, ('indice', False),
+                              lambda: cube.stats(cube.select(keys) & (respondentes > 0)),
+                              pasta_dados, persist=True)
+                n += 1
+                if not grande:
+                    cached_result(perfil, ano, keys, ('intervalos', False, BOOTSTRAP_SEED),
+                                  lambda: engine.intervals(rows), pasta_dados, persist=True)
+                    n += 1
+        if anos:
+            # As in Comparação: from the cubes when any year is streamed
+            Q = load_questions(perfil, pasta_dados)
+            def compare():
+                if any(streams(perfil, ano, pasta_dados) for ano in anos):
+                    engine = load_year_cubes(perfil, anos, pasta_dados, Q['subquestions'])
+                    return engine.index_by(anos), year_changes(engine, anos)
+                C = load_years(perfil, anos, pasta_dados)
+                engine = SatisfactionEngine(C, Q['subquestions'])
+                return engine.index_by(C['Ano']), year_changes(engine, C['Ano'])
+            cached_result(perfil, anos, {}, ('comparacao', False), compare, pasta_dados,
+                          persist=True)
+            n += 1
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cache de resultados em disco')
+    parser.add_argument('comando', choices=['aquecer', 'podar', 'verificar'])
+    parser.add_argument('--data', default='data', help='pasta com os dados por ano')
+    args = parser.parse_args()
+    if args.comando == 'aquecer':
+        t = time.perf_counter()
+        n = warm_up(args.data)
+        print(f'{n} resultados em {store_path(args.data)} ({time.perf_counter() - t:.1f} s)')
+        print(f'{prune(args.data)} resultados antigos removidos')
+    elif args.comando == 'podar':
+        print(f'{prune(args.data)} resultados removidos')
+    else:
+        check, bad = verify(args.data)
+        print(f'SQLite: {check}; {bad} resultados corrompidos removidos')
+        sys.exit(0 if check == 'ok' and not bad else 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Lightweight per-stage timers for the dashboard reruns.
+#
+#   start_run(memory=True)
+#   with span('filter'):
+#       ...
+#   @timed('satisfaction')
+#   def f(...): ...
+#   spans = end_run(perfil='Estudantes')
+#
+# Spans are only recorded between start_run() and end_run() of the current
+# thread (one Streamlit session rerun), so the helpers cost nothing in the
+# CLI tools. Work handed to a thread pool is wrapped with carry() so its spans
+# land in the same run. When CPA_TIMING_LOG names a file, end_run() appends the run to it
+# as one JSON line.
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+
+LOG_PATH = os.environ.get('CPA_TIMING_LOG')
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+
+
+def start_run(memory=False):
+    # memory=True samples tracemalloc peaks per span. tracemalloc is process
+    # wide, so peaks of concurrent sessions overlap; use it for diagnosis.
+    global _tracing_runs
+    _local.spans = []
+    _local.stack = []
+    _local.memory = memory
+    if memory:
+        with _tracing_lock:
+            if _tracing_runs == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _tracing_runs += 1
+
+def end_run(log_path=None, **labels):
+    global _tracing_runs
+    spans = getattr(_local, 'spans', None) or []
+    if getattr(_local, 'memory', False):
+        with _tracing_lock:
+            _tracing_runs -= 1
+            if _tracing_runs == 0:
+                tracemalloc.stop()
+    _local.spans = None
+    _local.memory = False
+    log_path = log_path or LOG_PATH
+    if log_path and spans:
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **labels, 'spans': spans}
+        with open(log_path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    return spans
+
+@contextmanager
+def span(stage, **labels):
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        yield
+        return
+    stack = _local.stack
+    record = {'stage': stage, **labels, 'depth': len(stack)}
+    memory = _local.memory and tracemalloc.is_tracing()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_base'], record['_peak'] = current, 0
+    spans.append(record)
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        stack.pop()
+        if memory:
+            record['_peak'] = max(record['_peak'], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1]['_peak'], record['_peak'])
+            record['peak_kb'] = round((record.pop('_peak') - record.pop('_base')) / 1024, 1)
+
+def carry(fun):
+    # Runs fun (in a pool worker) inside the current thread's run, its spans
+    # nested under the span open here.
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        return fun
+    stack, memory = list(_local.stack), _local.memory
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+        saved = (getattr(_local, 'spans', None), getattr(_local, 'stack', None),
+                 getattr(_local, 'memory', False))
+        _local.spans, _local.stack, _local.memory = spans, list(stack), memory
+        try:
+            return fun(*args, **kwargs)
+        finally:
+            _local.spans, _local.stack, _local.memory = saved
+    return wrapper
+
+def timed(stage=None):
+    def decorator(fun):
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with span(stage or fun.__name__):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
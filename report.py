@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Headless batch report: satisfaction summaries and percentage tables for
+# every profile x year x Campus x Perfil (nível do curso / categoria)
+# selection, written as CSV and HTML with a manifest.json index.
+#
+#   python report.py --out relatorios --workers 4
+import os
+import re
+import json
+import argparse
+import itertools
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from ingestion import PERFIS, data_path, listar_anos, load_questions
+from satisfaction import satisfaction_table
+from cube import load_cube
+from filters import suppress_single
+
+
+DIMS = ['Campus', 'Perfil']
+
+
+def slugify(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'vazio'
+
+def selections(cube, dims=DIMS):
+    # Every combination of a single value (or all values, None) per dim
+    dims = [d for d in dims if d in cube.dims]
+    values = [[None] + sorted(set(cube.cells[:, cube.dims.index(d)]) - {''}) for d in dims]
+    for combo in itertools.product(*values):
+        yield {d: v for d, v in zip(dims, combo)}
+
+def selection_tables(cube, selection, dic_q):
+    cells = cube.select({d: [v] for d, v in selection.items() if v is not None})
+    respondentes = int(cube.respondents[cells].sum())
+    summary = satisfaction_table(cube.stats(cells), list(dic_q), dic_q,
+                                 'Indice de Satisfação (%)', 'Não sei/Não se aplica (%)')
+    percentages = cube.percentages(cells).round(2)
+    percentages.index = [dic_q.get(i, i) for i in percentages.index]
+    return respondentes, summary, percentages
+
+def _html(title, selection, respondentes, summary, percentages):
+    filtros = ', '.join(f'{d}: {v or "Todos"}' for d, v in selection.items())
+    return (f'<html><head><meta charset="utf-8"><title>{title}</title></head><body>'
+            f'<h1>{title}</h1><p>{filtros}</p><p>Respondentes: {respondentes}</p>'
+            f'<h2>Índice de Satisfação</h2>{summary.to_html(float_format="{:.1f}".format)}'
+            f'<h2>Distribuição das respostas (%)</h2>{percentages.to_html(float_format="{:.1f}".format)}'
+            '</body></html>')
+
+def profile_year_report(perfil, ano, pasta_dados, out_dir):
+    # All selections of one (profile, year); runs in a worker process
+    cube = load_cube(perfil, ano, pasta_dados)
+    Q = load_questions(perfil, pasta_dados)
+    dic_q = dict(zip(Q['subquestions'].values, Q['text'].values))
+    folder = os.path.join(out_dir, perfil, str(ano))
+    os.makedirs(folder, exist_ok=True)
+    entries = []
+    for selection in selections(cube):
+        respondentes, summary, percentages = selection_tables(cube, selection, dic_q)
+        entry = {'perfil': perfil, 'ano': str(ano), 'respondentes': respondentes, **selection}
+        if not suppress_single(respondentes):
+            entries.append({**entry, 'arquivos': []})
+            continue
+        name = '_'.join(slugify(v) if v else 'todos' for v in selection.values()) or 'todos'
+        files = [os.path.join(folder, f'{name}_indice.csv'),
+                 os.path.join(folder, f'{name}_percentual.csv'),
+                 os.path.join(folder, f'{name}.html')]
+        summary.to_csv(files[0], index=True, sep=',', encoding='utf-8')
+        percentages.to_csv(files[1], index=True, sep=',', encoding='utf-8')
+        with open(files[2], 'w', encoding='utf-8') as file:
+            file.write(_html(f'Avalia UFJF - {perfil} {ano}', selection,
+                             respondentes, summary, percentages))
+        entries.append({**entry, 'arquivos': [os.path.relpath(f, out_dir) for f in files]})
+    return entries
+
+def build_reports(out_dir='relatorios', pasta_dados='data', perfis=None, anos=None,
+                  workers=None):
+    perfis = PERFIS if perfis is None else perfis
+    anos = listar_anos(pasta_dados) if anos is None else anos
+    jobs = [(perfil, ano) for perfil in perfis for ano in anos
+            if os.path.exists(data_path(perfil, ano, pasta_dados))]
+    os.makedirs(out_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(profile_year_report, perfil, ano, pasta_dados, out_dir)
+                   for perfil, ano in jobs]
+        manifest = [entry for future in futures for entry in future.result()]
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Relatórios de satisfação para todas as seleções')
+    parser.add_argument('--data', default='data', help='pasta com os dados por ano')
+    parser.add_argument('--out', default='relatorios', help='pasta de saída')
+    parser.add_argument('--perfil', action='append', help='perfil (padrão: todos)')
+    parser.add_argument('--ano', action='append', help='ano (padrão: todos)')
+    parser.add_argument('--workers', type=int, default=None, help='processos em paralelo')
+    args = parser.parse_args()
+    manifest = build_reports(args.out, args.data, args.perfil, args.ano, args.workers)
+    print(f'{len(manifest)} seleções em {args.out}')
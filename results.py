@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Process-wide cache of computed results (indexes, intervals, charts, API
+# responses) shared by every session. Entries are keyed by
+# (data version, perfil, ano, normalized selection, metric); the total size
+# is kept under a byte budget by evicting the least recently used entries.
+#
+# CPA_CACHE_MB sets the budget (default 256).
+import os
+import sys
+import threading
+import functools
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from ingestion import codebook_path, data_path, file_stamp, schema_path
+from persistence import stored_result
+
+
+BUDGET = int(float(os.environ.get('CPA_CACHE_MB', '256')) * 2**20)
+
+
+def nbytes(obj, seen=None):
+    # Approximate memory held by a result: frames and arrays by their
+    # buffers, containers and plain objects (e.g. Altair charts) recursively
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(nbytes(k, seen) + nbytes(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(nbytes(v, seen) for v in obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        return sys.getsizeof(obj) + nbytes(vars(obj), seen)
+    return sys.getsizeof(obj)
+
+
+class ResultCache:
+
+    def __init__(self, budget=BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build, size=nbytes):
+        # build() runs on a miss; a result larger than the whole budget is
+        # returned without being kept
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = build()
+        n = size(value)
+        with self.lock:
+            if n > self.budget:
+                return value
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, n)
+            self.size += n
+            while self.size > self.budget:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.size, 'budget': self.budget}
+
+
+RESULTS = ResultCache()
+
+
+def selection_key(selection):
+    # {facet: [values]} -> hashable, order-insensitive; empty facets dropped
+    return tuple(sorted((c, tuple(sorted(v))) for c, v in selection.items() if len(v)))
+
+def data_version(perfil, anos, pasta_dados='data'):
+    # Stamps of every file a result of (perfil, anos) is computed from
+    paths = [codebook_path(perfil, pasta_dados)]
+    for ano in anos:
+        paths += [data_path(perfil, ano, pasta_dados), schema_path(perfil, ano, pasta_dados)]
+    return tuple(file_stamp(p) for p in paths)
+
+def cached_result(perfil, ano, selection, metric, build, pasta_dados='data', cache=RESULTS,
+                  persist=False):
+    # `ano` may be a list of years (e.g. the Comparação tab); `metric` names
+    # the result and any option it depends on, e.g. ('intervalos', seed).
+    # With persist, a miss is looked up in the on-disk store (persistence.py)
+    # before building.
+    anos = sorted([ano] if isinstance(ano, str) else list(ano))
+    key = (perfil, tuple(anos), selection_key(selection), metric)
+    if persist:
+        build = functools.partial(stored_result, perfil, anos, key, build, pasta_dados)
+    return cache.get((data_version(perfil, anos, pasta_dados),) + key, build)
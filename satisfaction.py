@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from ingestion import cached, data_path, load_survey, schema_path
+
+
+repl0={
+ 'Concordo'                   : 0.66,
+ 'Concordo totalmente'        : 1,
+ 'Discordo'                   : 0.33,
+ 'Discordo totalmente'        : 0,
+ 'Não concordo nem discordo'  : None,
+ 'Não sei / Não se aplica'    : None,
+ '':None,
+}
+
+# Likert levels from full agreement to "não sei"; the position is the int8
+# code and -1 is the sentinel for blank answers, which count as "não sei".
+LEVELS = ['Concordo totalmente', 'Concordo', 'Não concordo nem discordo',
+          'Discordo', 'Discordo totalmente', 'Não sei / Não se aplica']
+NAO_SEI = LEVELS[-1]
+SCORES = np.array([np.nan if repl0[k] is None else repl0[k] for k in LEVELS] + [np.nan])
+
+# Percentile bootstrap of the index; the seed can be fixed per deployment
+# so the intervals shown are reproducible
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_LEVEL = 0.95
+BOOTSTRAP_SEED = int(os.environ.get('CPA_BOOTSTRAP_SEED', '0'))
+
+
+def answer_order(labels):
+    # Display order of a question's answer labels (codebook order): other
+    # options as listed, Likert levels in LEVELS order and "não sei" last
+    order = sorted(labels, key=lambda l: LEVELS.index(l) if l in LEVELS else -1)
+    return order if NAO_SEI in order else order + [NAO_SEI]
+
+def likert_codes(values, strict=True):
+    # int8 codes of a column, or None when it holds anything but Likert
+    # answers (or nothing at all, e.g. an item not asked in that year).
+    # strict=False codes such values as blank (-1) instead.
+    values = pd.Series(values).astype(object).fillna('')
+    codes = pd.Categorical(values, categories=LEVELS).codes.astype(np.int8)
+    if not strict:
+        return codes
+    answered = (values != '').to_numpy()
+    if not answered.any() or (codes[answered] < 0).any():
+        return None
+    return codes
+
+
+class SatisfactionEngine:
+    # Codes every Likert column of A once; the index, the number of valid
+    # answers and the share without a valid answer ("não sei", neutral or
+    # blank) of all items are then computed together for any subset of rows.
+
+    def __init__(self, A, columns=None):
+        coded = {}
+        for c in (A.columns if columns is None else columns):
+            if c in A.columns and c not in coded:
+                codes = likert_codes(A[c])
+                if codes is not None:
+                    coded[c] = codes
+        self.items = list(coded)
+        self.index = A.index
+        if coded:
+            self.codes = np.column_stack(list(coded.values()))
+        else:
+            self.codes = np.empty((len(A), 0), dtype=np.int8)
+
+    def rows(self, df):
+        # Boolean mask of the respondents of A that are present in df
+        return self.index.isin(df.index)
+
+    def stats(self, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = SCORES[codes]
+        valid = np.isfinite(scores).sum(axis=0)
+        total = np.nansum(scores, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = total / valid * 100
+            nao_sei = (1 - valid / len(codes)) * 100
+        return pd.DataFrame({'index': index, 'valid': valid, 'nao_sei': nao_sei},
+                            index=self.items).round(2)
+
+    def intervals(self, rows=None, resamples=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED,
+                  level=BOOTSTRAP_LEVEL):
+        # Bootstrap interval of the index of every item (columns lo, hi).
+        # Each resample draws the selected respondents with replacement; the
+        # draws are turned into a resample x respondent weight matrix, so all
+        # items are scored by two matrix products per block of resamples.
+        # A selection of one respondent has none.
+        rows = np.arange(len(self.codes)) if rows is None else np.asarray(rows)
+        rows = np.flatnonzero(rows) if rows.dtype == bool else rows
+        scores = SCORES[self.codes[rows]]
+        valid = np.isfinite(scores).astype(np.float32)
+        scores = np.nan_to_num(scores).astype(np.float32)
+        n = len(rows)
+        estimates = np.full((resamples, len(self.items)), np.nan)
+        if n > 1:
+            rng = np.random.default_rng(seed)
+            block = max(1, 2**22 // n)
+            for start in range(0, resamples, block):
+                b = min(block, resamples - start)
+                draws = rng.integers(0, n, (b, n)) + np.arange(b)[:, None] * n
+                weights = np.bincount(draws.ravel(), minlength=b * n).reshape(b, n)
+                weights = weights.astype(np.float32)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    estimates[start:start + b] = weights @ scores / (weights @ valid) * 100
+        tail = (1 - level) / 2 * 100
+        with warnings.catch_warnings():
+            # Items without a valid answer in the selection
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lo, hi = np.nanpercentile(estimates, [tail, 100 - tail], axis=0)
+        return pd.DataFrame({'lo': lo, 'hi': hi}, index=self.items).round(2)
+
+    def counts_by(self, groups):
+        # (sorted groups, group x item x level answer counts), the levels in
+        # LEVELS order plus blank last, from a single bincount
+        groups, inverse = np.unique(np.asarray(groups), return_inverse=True)
+        levels = len(LEVELS) + 1
+        cells = ((inverse[:, None] * len(self.items) + np.arange(len(self.items)))
+                 * levels + self.codes % levels)
+        counts = np.bincount(cells.ravel(), minlength=len(groups) * len(self.items) * levels)
+        return groups, counts.reshape(len(groups), len(self.items), levels)
+
+    def index_by(self, groups):
+        # Group x item matrix of indexes (e.g. one row per year), computed in
+        # a single grouped aggregation over the scores of all respondents
+        scores = pd.DataFrame(SCORES[self.codes], columns=self.items)
+        grouped = scores.groupby(np.asarray(groups))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (grouped.sum() / grouped.count() * 100).round(2)
+
+
+def satisfaction_table(stats, cols, dic_q, label='Indice de Satisfação (%)',
+                       nao_sei=None, intervals=None):
+    # Index of the items in `cols` (in that order), labelled by their text;
+    # `nao_sei` names an optional column with the share without valid answer
+    # and `intervals` (SatisfactionEngine.intervals) adds its bounds
+    stats = stats.loc[[c for c in cols if c in stats.index]]
+    table = pd.DataFrame({label: stats['index'].values},
+                         index=[dic_q[i] for i in stats.index])
+    if intervals is not None:
+        level = round(BOOTSTRAP_LEVEL * 100)
+        bounds = intervals.reindex(stats.index)
+        table[f'IC {level}% inf.'] = bounds['lo'].values
+        table[f'IC {level}% sup.'] = bounds['hi'].values
+    if nao_sei is not None:
+        table[nao_sei] = stats['nao_sei'].values
+    return table
+
+
+def load_engine(perfil, ano, pasta_dados='data'):
+    # Coded Likert answers of one export, cached with it
+    return cached(f'satisfacao-{perfil}', data_path(perfil, ano, pasta_dados),
+                  lambda path: SatisfactionEngine(load_survey(perfil, ano, pasta_dados)),
+                  depends=(schema_path(perfil, ano, pasta_dados),))
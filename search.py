@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Accent-insensitive full-text index (BM25) over the open-ended answers
+# (Qaberta / ABERTA) of every year, cached on disk next to the exports.
+#
+#   python search.py Estudantes "restaurante universitario"
+import os
+import re
+import sys
+import json
+import unicodedata
+import numpy as np
+import pandas as pd
+from ingestion import (OPEN_TEXT, cached, data_path, file_stamp, listar_anos, load_survey,
+                       read_survey_chunks, schema_path)
+from filters import FilterIndex, suppress_single
+
+
+# Bump when the tokenizer or the layout of the index changes
+INDEX_VERSION = 2
+
+# Facets kept with every answer; the search results are filtered and shown
+# by the SEARCH_FACETS only (Unidade / LOTACAO feed the theme analytics)
+SEARCH_FACETS = ['Ano', 'Campus', 'Perfil']
+TEXT_FACETS = SEARCH_FACETS + ['Unidade', 'LOTACAO']
+
+
+def normalize(text):
+    # Lowercase without accents: "Inscrição" -> "inscricao"
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', normalize(text))
+
+
+class SearchIndex:
+    # Postings in CSR layout: the documents of term t are
+    # docs[indptr[t]:indptr[t+1]] with their term frequencies in tf.
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, texts, facets, vocab, indptr, docs, tf, lengths):
+        self.texts = texts
+        self.facets = facets
+        self.vocab = vocab
+        self.indptr = indptr
+        self.docs = docs
+        self.tf = tf
+        self.lengths = lengths
+        n = len(texts)
+        df = np.diff(indptr)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        self.avgdl = lengths.mean() if n else 0.0
+        self.filters = FilterIndex(facets, [c for c in SEARCH_FACETS if c in facets.columns])
+
+    @classmethod
+    def build(cls, texts, facets):
+        vocab = {}
+        rows, terms, counts, lengths = [], [], [], []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            ids, tf = np.unique([vocab.setdefault(t, len(vocab)) for t in tokens],
+                                return_counts=True)
+            rows.append(np.full(len(ids), i, dtype=np.int32))
+            terms.append(ids)
+            counts.append(tf)
+        rows = np.concatenate(rows or [np.empty(0, dtype=np.int32)])
+        terms = np.concatenate(terms or [np.empty(0, dtype=np.int64)]).astype(np.int64)
+        counts = np.concatenate(counts or [np.empty(0, dtype=np.int64)]).astype(np.int32)
+        order = np.lexsort((rows, terms))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(vocab)))])
+        return cls(list(texts), facets.reset_index(drop=True), vocab, indptr,
+                   rows[order], counts[order], np.array(lengths, dtype=np.int32))
+
+    def search(self, query, selection=None, k=20):
+        # Best k answers for the query among the respondents of `selection`
+        # ({facet: [values]}); a selection too small to show returns nothing
+        scores = np.zeros(len(self.texts))
+        for token in dict.fromkeys(tokenize(query)):
+            t = self.vocab.get(token)
+            if t is None:
+                continue
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            docs, tf = self.docs[lo:hi], self.tf[lo:hi]
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[docs] / self.avgdl)
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1) / (tf + norm)
+        mask = self.filters.select(selection or {})
+        if not suppress_single(mask.sum()):
+            mask[:] = False
+        hits = np.flatnonzero((scores > 0) & mask)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind='stable')]
+        shown = [c for c in SEARCH_FACETS if c in self.facets.columns]
+        result = self.facets[shown].iloc[hits].copy()
+        result.insert(0, 'Resposta', [self.texts[i] for i in hits])
+        result['score'] = scores[hits].round(2)
+        return result.reset_index(drop=True)
+
+    def save(self, path, stamp):
+        blob = [t.encode('utf-8') for t in self.texts]
+        offsets = np.concatenate([[0], np.cumsum([len(b) for b in blob])]).astype(np.int64)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez_compressed(file, text=np.frombuffer(b''.join(blob), dtype=np.uint8),
+                                offsets=offsets, vocab=np.array(list(self.vocab), dtype=str),
+                                indptr=self.indptr, docs=self.docs, tf=self.tf,
+                                lengths=self.lengths, stamp=np.array(stamp),
+                                **{f'facet_{c}': self.facets[c].to_numpy(dtype=str)
+                                   for c in self.facets.columns})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            blob, offsets = z['text'].tobytes(), z['offsets']
+            texts = [blob[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+            facets = pd.DataFrame({name[len('facet_'):]: z[name].astype(object)
+                                   for name in z.files if name.startswith('facet_')})
+            vocab = {t: i for i, t in enumerate(z['vocab'].tolist())}
+            index = cls(texts, facets, vocab, z['indptr'], z['docs'], z['tf'], z['lengths'])
+            return index, str(z['stamp'])
+
+
+def open_answers(perfil, ano, pasta_dados='data'):
+    # Non-blank open answers of one export with their facets. The text is
+    # read as exported (the suppression would blank nearly every answer);
+    # the facets come from the suppressed survey, row by row.
+    text = pd.concat(list(read_survey_chunks(perfil, ano, pasta_dados, columns=OPEN_TEXT)))
+    A = load_survey(perfil, ano, pasta_dados, columns=TEXT_FACETS)
+    facets = A.astype(object).assign(Ano=str(ano))
+    text = text.iloc[:, 0] if text.shape[1] else pd.Series('', index=A.index)
+    text = text.fillna('').str.strip().to_numpy()
+    answered = text != ''
+    return text[answered], facets[answered]
+
+def index_path(perfil, pasta_dados='data'):
+    return os.path.join(pasta_dados, f'{perfil}_busca.npz')
+
+def index_sources(perfil, pasta_dados):
+    anos = [ano for ano in listar_anos(pasta_dados)
+            if os.path.exists(data_path(perfil, ano, pasta_dados))]
+    return anos, [p for ano in anos for p in (data_path(perfil, ano, pasta_dados),
+                                               schema_path(perfil, ano, pasta_dados))]
+
+def _load_or_build(perfil, pasta_dados):
+    path = index_path(perfil, pasta_dados)
+    anos, sources = index_sources(perfil, pasta_dados)
+    stamp = json.dumps([[file_stamp(p) for p in sources], INDEX_VERSION])
+    if os.path.exists(path):
+        try:
+            index, saved = SearchIndex.load(path)
+            if saved == stamp:
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    parts = [open_answers(perfil, ano, pasta_dados) for ano in anos]
+    texts = [t for text, _ in parts for t in text]
+    facets = pd.concat([f for _, f in parts], ignore_index=True).fillna('')
+    index = SearchIndex.build(texts, facets[[c for c in TEXT_FACETS if c in facets.columns]])
+    try:
+        index.save(path, stamp)
+    except OSError:
+        pass
+    return index
+
+def load_index(perfil, pasta_dados='data'):
+    # Cached in memory and on disk; rebuilt when any year's export or column
+    # schema changes
+    _, sources = index_sources(perfil, pasta_dados)
+    return cached(f'busca-{perfil}', sources[0], lambda path: _load_or_build(perfil, pasta_dados),
+                  depends=tuple(sources[1:]))
+
+
+if __name__ == "__main__":
+    perfil, query = sys.argv[1], ' '.join(sys.argv[2:])
+    print(load_index(perfil).search(query).to_string())
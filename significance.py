@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Year-over-year significance of the satisfaction items. For every item and
+# every pair of consecutive years, from the (year, item, level) answer
+# counts of SatisfactionEngine.counts_by:
+#
+#   - two-proportion z test of the favourable share (Concordo totalmente +
+#     Concordo among the scored answers);
+#   - chi-square test of homogeneity of the scored levels (2 x 4 table).
+#
+# All tests are computed together as arrays; the p-values of each kind are
+# corrected over the whole matrix with Benjamini-Hochberg.
+import numpy as np
+import pandas as pd
+from satisfaction import LEVELS, SCORES
+
+
+ALPHA = 0.05
+
+SCORED = np.flatnonzero(np.isfinite(SCORES[:len(LEVELS)]))
+FAVORABLE = np.array([LEVELS.index('Concordo totalmente'), LEVELS.index('Concordo')])
+
+
+def erfc(x):
+    # Complementary error function, fractional error below 1.2e-7
+    # (Numerical Recipes, erfcc)
+    z = np.abs(x)
+    t = 1 / (1 + 0.5 * z)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (
+        0.09678418 + t * (-0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (
+            1.48851587 + t * (-0.82215223 + t * 0.17087277)))))))))
+    return np.where(x >= 0, r, 2 - r)
+
+def chi2_sf(x, df):
+    # Chi-square survival function for small integer degrees of freedom,
+    # from df = 1 or 2 by the recurrence
+    # sf(x, k + 2) = sf(x, k) + (x/2)^(k/2) e^(-x/2) / Gamma(k/2 + 1)
+    h = np.asarray(x, dtype=float) / 2
+    df = np.asarray(df)
+    odd = df % 2 == 1
+    with np.errstate(invalid='ignore'):
+        sf = np.where(odd, erfc(np.sqrt(h)), np.exp(-h))
+        term = np.where(odd, 2 * np.sqrt(h / np.pi) * np.exp(-h), h * np.exp(-h))
+    k = np.where(odd, 1, 2)
+    while (k < df).any():
+        step = k < df
+        sf = np.where(step, sf + term, sf)
+        k = np.where(step, k + 2, k)
+        term = term * h / (k / 2)
+    return np.where(df > 0, np.clip(sf, 0, 1), np.nan)
+
+def benjamini_hochberg(p):
+    # Adjusted p-values (q) of all the finite entries of p, any shape
+    p = np.asarray(p, dtype=float)
+    q = np.full(p.shape, np.nan)
+    tested = np.flatnonzero(np.isfinite(p))
+    order = tested[np.argsort(p.flat[tested], kind='stable')]
+    m = len(order)
+    if m:
+        adjusted = p.flat[order] * m / np.arange(1, m + 1)
+        q.flat[order] = np.clip(np.minimum.accumulate(adjusted[::-1])[::-1], 0, 1)
+    return q
+
+
+def change_tests(counts):
+    # counts: (years, items, levels) answer counts, levels as in
+    # SatisfactionEngine.counts_by. Returns (years - 1, items) arrays
+    # comparing each year with the previous one; a year with at most one
+    # scored answer for an item is not tested.
+    scored = counts[..., SCORED].astype(float)
+    a, b = scored[:-1], scored[1:]
+    n_a, n_b = a.sum(axis=-1), b.sum(axis=-1)
+    tested = (n_a > 1) & (n_b > 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Two proportions, pooled standard error
+        f_a = counts[:-1][..., FAVORABLE].sum(axis=-1) / n_a
+        f_b = counts[1:][..., FAVORABLE].sum(axis=-1) / n_b
+        pooled = (f_a * n_a + f_b * n_b) / (n_a + n_b)
+        z = (f_b - f_a) / np.sqrt(pooled * (1 - pooled) * (1 / n_a + 1 / n_b))
+        z = np.where(tested & np.isfinite(z), z, np.nan)
+        p_prop = erfc(np.abs(z) / np.sqrt(2))
+        # 2 x levels homogeneity, levels unused in both years dropped
+        total = a + b
+        expected_a = total * (n_a / (n_a + n_b))[..., None]
+        expected_b = total - expected_a
+        used = total > 0
+        chi2 = np.where(used, (a - expected_a) ** 2 / expected_a
+                        + (b - expected_b) ** 2 / expected_b, 0).sum(axis=-1)
+        df = used.sum(axis=-1) - 1
+        chi2 = np.where(tested & (df > 0), chi2, np.nan)
+        p_chi2 = chi2_sf(np.nan_to_num(chi2), df)
+    p_prop = np.where(np.isfinite(z), p_prop, np.nan)
+    p_chi2 = np.where(np.isfinite(chi2), p_chi2, np.nan)
+    q_prop, q_chi2 = benjamini_hochberg(p_prop), benjamini_hochberg(p_chi2)
+    return {'z': z, 'p_prop': p_prop, 'q_prop': q_prop,
+            'chi2': chi2, 'p_chi2': p_chi2, 'q_chi2': q_chi2}
+
+def year_changes(engine, years, alpha=ALPHA):
+    # Year x item frame (as SatisfactionEngine.index_by): True where the item
+    # changed significantly since the previous year; the first year is False
+    groups, counts = engine.counts_by(years)
+    tests = change_tests(counts)
+    significant = (tests['q_prop'] < alpha) | (tests['q_chi2'] < alpha)
+    flags = np.vstack([np.zeros((min(len(groups), 1), len(engine.items)), dtype=bool), significant])
+    return pd.DataFrame(flags, index=groups, columns=engine.items)
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Static export of the dashboard for a plain file server: every profile x
+# year x Campus x Perfil selection (as in report.py) is precomputed into a
+# JSON shard with its tables and Vega-Lite specs, and index.html fetches
+# the shard of the chosen selection on demand.
+#
+#   python static_site.py --out site --workers 4
+#
+#   site/index.html
+#   site/index.json                         selections -> shard
+#   site/dados/{perfil}/{ano}/{nome}.json    one shard per selection
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from ingestion import PERFIS, data_path, listar_anos, load_questions
+from satisfaction import answer_order
+from charts import percentage_chart
+from cube import load_cube
+from filters import suppress_single
+from report import DIMS, selection_tables, selections, slugify
+
+
+def _table(df):
+    # {'columns', 'index', 'data'} with NaN as null
+    return json.loads(df.round(1).to_json(orient='split', force_ascii=False))
+
+def _plot_data(percentages, items):
+    # Long table of percentage_chart from cube percentages, answers without
+    # any respondent left out
+    plot_df = percentages.loc[items].rename_axis('text').reset_index()
+    plot_df = plot_df.melt(id_vars='text', var_name='data', value_name='percentage')
+    return plot_df[plot_df['percentage'] > 0]
+
+def chart_spec(template, chart):
+    # Vega-Lite spec of a chart, reusing the spec of an equal chart built
+    # once per group; only the data changes between selections
+    spec = {k: v for k, v in template.items() if k != 'datasets'}
+    spec['data'] = {'values': json.loads(chart.data.to_json(orient='records', force_ascii=False))}
+    return spec
+
+def selection_shard(cube, selection, dic_q, groups, order, templates):
+    respondentes, summary, percentages = selection_tables(cube, selection, dic_q)
+    shard = {'respondentes': respondentes, 'selecao': selection, 'resumo': _table(summary),
+             'grupos': []}
+    percentages = percentages.round(2)
+    for grupo, items in groups.items():
+        texts = [dic_q[i] for i in items]
+        chart = percentage_chart(_plot_data(percentages, texts), order)
+        if grupo not in templates:
+            templates[grupo] = chart.to_dict()
+        indice = summary.loc[[t for t in texts if t in summary.index]].iloc[:, :1]
+        shard['grupos'].append({'grupo': grupo, 'indice': _table(indice),
+                                'grafico': chart_spec(templates[grupo], chart)})
+    return respondentes, shard
+
+def profile_year_site(perfil, ano, pasta_dados, out_dir):
+    # Shards of all selections of one (profile, year); runs in a worker
+    cube = load_cube(perfil, ano, pasta_dados)
+    Q = load_questions(perfil, pasta_dados)
+    Q = Q[Q['subquestions'].isin(cube.items)]
+    dic_q = dict(zip(Q['subquestions'].values, Q['text'].values))
+    groups = {g: list(Q.loc[Q['question_data'] == g, 'subquestions'])
+              for g in sorted(Q['question_data'].unique())}
+    order = answer_order(list(cube.percentages().columns))
+    folder = os.path.join(out_dir, 'dados', perfil, str(ano))
+    os.makedirs(folder, exist_ok=True)
+    templates = {}
+    entries = {}
+    for selection in selections(cube):
+        key = '|'.join(v or '' for v in selection.values())
+        respondentes, shard = selection_shard(cube, selection, dic_q, groups, order, templates)
+        if not suppress_single(respondentes):
+            entries[key] = None
+            continue
+        name = '_'.join(slugify(v) if v else 'todos' for v in selection.values()) or 'todos'
+        path = os.path.join(folder, f'{name}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'perfil': perfil, 'ano': str(ano), **shard}, file, ensure_ascii=False)
+        entries[key] = os.path.relpath(path, out_dir).replace(os.sep, '/')
+    dims = [d for d in DIMS if d in cube.dims]
+    valores = {d: sorted(set(cube.cells[:, cube.dims.index(d)]) - {''}) for d in dims}
+    return perfil, str(ano), {'dims': dims, 'valores': valores, 'selecoes': entries}
+
+def build_site(out_dir='site', pasta_dados='data', perfis=None, anos=None, workers=None):
+    perfis = PERFIS if perfis is None else perfis
+    anos = listar_anos(pasta_dados) if anos is None else anos
+    jobs = [(perfil, ano) for perfil in perfis for ano in anos
+            if os.path.exists(data_path(perfil, ano, pasta_dados))]
+    os.makedirs(out_dir, exist_ok=True)
+    index = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(profile_year_site, perfil, ano, pasta_dados, out_dir)
+                   for perfil, ano in jobs]
+        for future in futures:
+            perfil, ano, entry = future.result()
+            index.setdefault(perfil, {})[ano] = entry
+    with open(os.path.join(out_dir, 'index.json'), 'w', encoding='utf-8') as file:
+        json.dump(index, file, ensure_ascii=False)
+    with open(os.path.join(out_dir, 'index.html'), 'w', encoding='utf-8') as file:
+        file.write(PAGE)
+    return index
+
+
+# Client side: the selectors come from index.json and each selection's
+# shard is fetched (once) when chosen
+PAGE = '''<!DOCTYPE html>
+<html lang="pt-br"><head><meta charset="utf-8">
+<title>Avalia UFJF</title>
+<script src="https://cdn.jsdelivr.net/npm/vega@6"></script>
+<script src="https://cdn.jsdelivr.net/npm/vega-lite@6"></script>
+<script src="https://cdn.jsdelivr.net/npm/vega-embed@7"></script>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 1em; }
+td, th { border: 1px solid #ccc; padding: 2px 6px; }
+td { text-align: right; }
+th { text-align: left; font-weight: normal; }
+select { margin-right: 1em; }
+</style></head>
+<body>
+<h1>Universidade Federal de Juiz de Fora</h1>
+<p><a href="https://www2.ufjf.br/cpa/"><b>Comissão Própria de Avaliação</b></a></p>
+<h2>Avalia UFJF</h2>
+<div id="filtros"></div>
+<div id="resultado"></div>
+<script>
+let index = null;
+const shards = new Map();
+
+function select(id, label, values, onchange) {
+  const s = document.createElement('select');
+  s.id = id;
+  for (const [value, text] of values) {
+    const o = document.createElement('option');
+    o.value = value;
+    o.textContent = text;
+    s.appendChild(o);
+  }
+  s.onchange = onchange;
+  const l = document.createElement('label');
+  l.textContent = label + ' ';
+  l.appendChild(s);
+  return l;
+}
+
+function table(t) {
+  let html = '<table><tr><th></th>' + t.columns.map(c => `<th>${c}</th>`).join('') + '</tr>';
+  t.index.forEach((row, i) => {
+    html += `<tr><th>${row}</th>` + t.data[i].map(v => `<td>${v === null ? '-' : v.toFixed(1)}</td>`).join('') + '</tr>';
+  });
+  return html + '</table>';
+}
+
+function filters() {
+  const div = document.getElementById('filtros');
+  const perfil = document.getElementById('perfil')?.value || Object.keys(index)[0];
+  const ano = document.getElementById('ano')?.value;
+  div.innerHTML = '';
+  div.appendChild(select('perfil', 'Perfil', Object.keys(index).map(p => [p, p]), filters));
+  document.getElementById('perfil').value = perfil;
+  const anos = Object.keys(index[perfil]).sort().reverse();
+  div.appendChild(select('ano', 'Ano', anos.map(a => [a, a]), filters));
+  document.getElementById('ano').value = anos.includes(ano) ? ano : anos[0];
+  const entry = index[perfil][document.getElementById('ano').value];
+  for (const d of entry.dims) {
+    div.appendChild(select('dim-' + d, d, [['', 'Todos'], ...entry.valores[d].map(v => [v, v])], show));
+  }
+  show();
+}
+
+async function show() {
+  const perfil = document.getElementById('perfil').value;
+  const entry = index[perfil][document.getElementById('ano').value];
+  const key = entry.dims.map(d => document.getElementById('dim-' + d).value).join('|');
+  const out = document.getElementById('resultado');
+  const path = entry.selecoes[key];
+  if (!path) {
+    out.innerHTML = '<p>Respondentes: 0</p>';
+    return;
+  }
+  if (!shards.has(path)) {
+    shards.set(path, fetch(path).then(r => r.json()));
+  }
+  const shard = await shards.get(path);
+  out.innerHTML = `<p>Respondentes: ${shard.respondentes}</p>`;
+  shard.grupos.forEach((g, i) => {
+    const details = document.createElement('details');
+    details.innerHTML = `<summary><b>${g.grupo}</b></summary>${table(g.indice)}<div id="grafico-${i}"></div>`;
+    details.ontoggle = () => {
+      if (details.open && !details.dataset.desenhado) {
+        details.dataset.desenhado = '1';
+        vegaEmbed(`#grafico-${i}`, g.grafico, {actions: false});
+      }
+    };
+    out.appendChild(details);
+  });
+  const resumo = document.createElement('div');
+  resumo.innerHTML = '<h2>Resumo dos indicadores</h2>' + table(shard.resumo);
+  out.appendChild(resumo);
+}
+
+fetch('index.json').then(r => r.json()).then(data => { index = data; filters(); });
+</script>
+</body></html>
+'''
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exporta o painel como site estático (HTML + JSON)')
+    parser.add_argument('--data', default='data', help='pasta com os dados por ano')
+    parser.add_argument('--out', default='site', help='pasta de saída')
+    parser.add_argument('--perfil', action='append', help='perfil (padrão: todos)')
+    parser.add_argument('--ano', action='append', help='ano (padrão: todos)')
+    parser.add_argument('--workers', type=int, default=None, help='processos em paralelo')
+    args = parser.parse_args()
+    index = build_site(args.out, args.data, args.perfil, args.ano, args.workers)
+    total = sum(len(e['selecoes']) for anos in index.values() for e in anos.values())
+    print(f'{total} seleções em {args.out}')
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Synthetic LimeSurvey exports that follow the Códigos_{perfil}.csv
+# codebooks, for benchmarking the pipeline beyond the real ~1k rows.
+#
+#   python synthetic.py --rows 100000 --out /tmp/sintetico
+import os
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from codebook import compile_codebook
+from ingestion import PERFIS, codebook_path, data_path, listar_anos, schema_path
+from satisfaction import NAO_SEI
+
+
+# Average answer shares of the real 2021/2024 Likert items (without
+# "não sei"); each synthetic item draws its own shares around them
+LIKERT_PROFILE = {
+    'Concordo totalmente'       : 0.14,
+    'Concordo'                  : 0.40,
+    'Não concordo nem discordo' : 0.20,
+    'Discordo'                  : 0.17,
+    'Discordo totalmente'       : 0.09,
+}
+
+OPEN_ANSWERS = [
+    'NADA A DECLARAR',
+    'Nada a declarar.',
+    'Melhorar o RU e ampliar o horário de funcionamento.',
+    'Falta estacionamento no campus.',
+    'O transporte até o campus precisa melhorar.',
+    'Mais divulgação das ações da CPA.',
+    'A manutenção dos prédios é insuficiente.',
+    'Mais bolsas de monitoria e de extensão.',
+    'A comunicação entre os setores é lenta.',
+    'Segurança no campus à noite.',
+]
+
+
+def codebook_columns(cod_path):
+    # [(column, kind, [answer labels])] in export order; kind is the
+    # LimeSurvey question type ('L', '!', 'F', 'T', ...)
+    codebook = compile_codebook(cod_path)
+    return [(name, q['kind'], codebook.labels(question_id))
+            for question_id, q in codebook.questions.items()
+            for name in codebook.column_names(question_id)]
+
+def _skewed(rng, k, concentration=0.8):
+    # Category probabilities with a few dominant options (campus, unidade...)
+    return rng.dirichlet(np.full(k, concentration))
+
+def synthesize(perfil, n, pasta_dados='data', seed=0, nao_sei=0.12, blank=0.01,
+               open_rate=0.25, part=0):
+    # The answer distributions depend on `seed` only; `part` varies the draws
+    # so consecutive chunks of one export share the same distributions
+    skew = np.random.default_rng(seed)
+    rng = np.random.default_rng([seed, part])
+    data = {}
+    for name, kind, answers in codebook_columns(codebook_path(perfil, pasta_dados)):
+        if kind == 'T':
+            values = rng.choice(np.array(OPEN_ANSWERS, dtype=object), size=n)
+            values[rng.random(n) >= open_rate] = ''
+        elif answers:
+            labels = np.array(answers, dtype=object)
+            if set(answers) & set(LIKERT_PROFILE):
+                # Likert item: item-specific shares plus the global "não sei" rate
+                base = np.array([LIKERT_PROFILE.get(a, 0.01) for a in answers])
+                p = skew.dirichlet(40 * base / base.sum())
+                if NAO_SEI in answers:
+                    p = p * (1 - nao_sei)
+                    p[answers.index(NAO_SEI)] = nao_sei
+                p /= p.sum()
+            else:
+                p = _skewed(skew, len(answers))
+            values = labels[rng.choice(len(labels), size=n, p=p)]
+            values[rng.random(n) < blank] = ''
+        else:
+            values = np.full(n, '', dtype=object)
+        data[name] = values
+    return pd.DataFrame(data)
+
+def write_export(perfil, ano, n, out_dir, pasta_dados='data', seed=0, chunk=100_000, **kwargs):
+    # Writes {out_dir}/{ano}/{perfil}_dados_{ano}.csv in chunks so 1M rows
+    # never sit in memory at once, and copies the codebook and the column
+    # schema of the latest cycle (the codebook's column names) next to it
+    path = data_path(perfil, ano, out_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cod_path = codebook_path(perfil, out_dir)
+    os.makedirs(os.path.dirname(cod_path), exist_ok=True)
+    shutil.copyfile(codebook_path(perfil, pasta_dados), cod_path)
+    shutil.copyfile(schema_path(perfil, max(listar_anos(pasta_dados)), pasta_dados),
+                    os.path.join(os.path.dirname(path), f'{perfil}_esquema_{ano}.csv'))
+    for i, start in enumerate(range(0, n, chunk)):
+        A = synthesize(perfil, min(chunk, n - start), pasta_dados, seed, part=i, **kwargs)
+        A.to_csv(path, sep=';', index=False, mode='w' if i == 0 else 'a', header=i == 0)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Gera exportações sintéticas a partir dos códigos')
+    parser.add_argument('--rows', type=int, action='append', help='respondentes (padrão: 10k, 100k, 1M)')
+    parser.add_argument('--out', default='sintetico', help='pasta de saída')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # Each size goes to its own "year" folder, e.g. sintetico/100000/
+    for n in args.rows or [10_000, 100_000, 1_000_000]:
+        for perfil in PERFIS:
+            print(write_export(perfil, str(n), n, args.out, seed=args.seed))
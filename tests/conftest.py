@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ingestion
+
+
+@pytest.fixture
+def pasta(tmp_path):
+    # Empty data folder; the in-process caches are dropped around each test
+    ingestion.invalidate()
+    yield tmp_path
+    ingestion.invalidate()
+
+
+def write_export(pasta, perfil, ano, rows, schema=None):
+    # {perfil}_dados_{ano}.csv from a list of dicts, with an identity column
+    # schema unless one is given as {export column: canonical column}
+    folder = os.path.join(pasta, str(ano))
+    os.makedirs(folder, exist_ok=True)
+    columns = list(rows[0])
+    schema = schema or {c: c for c in columns}
+    with open(os.path.join(folder, f'{perfil}_esquema_{ano}.csv'), 'w', encoding='utf-8') as file:
+        file.write('exportacao;coluna\n')
+        file.writelines(f'{e};{c}\n' for e, c in schema.items())
+    with open(ingestion.data_path(perfil, ano, pasta), 'w', encoding='utf-8') as file:
+        file.write(';'.join(columns) + '\n')
+        file.writelines(';'.join(str(r[c]) for c in columns) + '\n' for r in rows)
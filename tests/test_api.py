@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import os
+from conftest import ROOT
+from api import ApiError, comparison, route
+
+DATA = os.path.join(ROOT, 'data')
+
+
+def test_comparison_with_a_facet_of_the_other_profile():
+    # Estudantes have no LOTACAO: nobody matches, as in /indice
+    result = comparison('Estudantes', ['2021', '2024'], {'LOTACAO': ['x']}, DATA)
+    assert result['respondentes'] == {'2021': 0, '2024': 0}
+    assert result['anos'] == []
+
+
+def _status(path, params):
+    try:
+        route(path, params, DATA)
+    except ApiError as e:
+        return e.status
+    return 200
+
+
+def test_perfil_and_ano_are_validated():
+    assert _status('/indice', {'perfil': ['Estudantes'], 'ano': ['2024']}) == 200
+    assert _status('/indice', {'perfil': ['Estudantes']}) == 400
+    assert _status('/indice', {'perfil': ['../2024/Estudantes'], 'ano': ['2024']}) == 404
+    assert _status('/percentual', {'perfil': ['Docentes'], 'ano': ['2024']}) == 404
+    assert _status('/indice', {'perfil': ['Estudantes'], 'ano': ['../2024']}) == 404
+    assert _status('/percentual', {'perfil': ['Estudantes'], 'ano': ['1999']}) == 404
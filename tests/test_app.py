@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import os
+from streamlit.testing.v1 import AppTest
+import cube
+import ingestion
+from conftest import ROOT
+
+APP = os.path.join(ROOT, 'app.py')
+
+
+def _resultados(monkeypatch, stream_bytes):
+    # Respondents and index tables of the Resultados tab with Campus set
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(cube, 'STREAM_BYTES', stream_bytes)
+    at = AppTest.from_file(APP, default_timeout=300).run()
+    campus = at.multiselect(key='res-Campus')
+    campus.set_value([campus.options[0]]).run()
+    assert not at.exception
+    index = [t.value.iloc[:, 0] for t in at.tabs[0].table]
+    return at.tabs[0].metric[0].value, index, list(at.tabs[0].table[0].value.columns)
+
+
+def test_resultados_from_the_streamed_cube(monkeypatch):
+    respondentes, index, columns = _resultados(monkeypatch, cube.STREAM_BYTES)
+    streamed, streamed_index, streamed_columns = _resultados(monkeypatch, 0)
+    assert streamed == respondentes
+    assert index and len(streamed_index) == len(index)
+    for a, b in zip(index, streamed_index):
+        assert a.equals(b)
+    # No bootstrap intervals without the respondent rows
+    assert len(columns) > 1 and len(streamed_columns) == 1
+
+
+def test_streamed_exports_are_never_loaded(monkeypatch):
+    # Every tab of a streamed profile works from the cubes or shows a notice
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(cube, 'STREAM_BYTES', 0)
+    loaded = []
+    def spy(perfil, ano, *args, **kwargs):
+        loaded.append((perfil, ano))
+        raise AssertionError('export loaded')
+    ingestion.invalidate()
+    monkeypatch.setattr(ingestion, 'load_snapshot', spy)
+    at = AppTest.from_file(APP, default_timeout=300).run()
+    at.radio[0].set_value('Servidores').run()
+    assert not at.exception and not loaded
+    assert len(at.tabs[1].table) > 0
+    assert len(at.tabs[2].info) == 1 and len(at.tabs[3].info) == 1
+    ingestion.invalidate()
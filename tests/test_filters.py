@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from conftest import write_export
+from filters import load_filters, suppress_single
+
+
+def test_filter_index_is_cached_with_the_export(pasta):
+    rows = [{'Campus': c, 'Perfil': p} for c, p in
+            [('A', 'x'), ('A', 'x'), ('A', 'y'), ('B', 'y'), ('B', 'y')]]
+    write_export(pasta, 'Estudantes', '2024', rows)
+    index = load_filters('Estudantes', '2024', ['Campus', 'Perfil'], pasta)
+    assert load_filters('Estudantes', '2024', ['Campus', 'Perfil'], pasta) is index
+    assert index.counts({'Perfil': ['y']}, 'Campus') == {'A': 1, 'B': 2}
+    # Rows weighted 0 (e.g. repeated submissions) are not counted
+    weighted = index.weighted([1, 1, 1, 0, 1])
+    assert weighted.counts({'Perfil': ['y']}, 'Campus') == {'A': 1, 'B': 1}
+    assert weighted.total(index.select({'Campus': ['B']})) == 1
+    assert index.total(index.select({'Campus': ['B']})) == 2
+    assert np.array_equal(index.select({'Campus': ['A'], 'Perfil': ['y']}),
+                          [False, False, True, False, False])
+
+
+def test_single_respondents_are_suppressed():
+    assert [suppress_single(n) for n in (0, 1, 2, 7)] == [0, 0, 2, 7]
+    assert suppress_single(np.array([1, 3, 0, 2])).tolist() == [0, 3, 0, 2]
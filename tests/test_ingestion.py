@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import ROOT, write_export
+from ingestion import (PERFIS, data_path, listar_anos, load_snapshot, load_survey,
+                       load_years, read_csv_survey, remove_single_occurrences, snapshot_path)
+from profiling import end_run, span, start_run
+
+DATA = os.path.join(ROOT, 'data')
+
+
+def test_numeric_column_with_rare_value(pasta):
+    # lastpage 7 is answered once and blanked: the snapshot must still be
+    # written and the survey loaded
+    rows = [{'Campus': 'A', 'lastpage': 12}, {'Campus': 'A', 'lastpage': 12},
+            {'Campus': 'B', 'lastpage': 12}, {'Campus': 'B', 'lastpage': 7}]
+    write_export(pasta, 'Estudantes', '2024', rows)
+    A = load_survey('Estudantes', '2024', pasta)
+    assert list(A['lastpage']) == ['12', '12', '12', '']
+    assert list(A['Campus']) == ['A', 'A', 'B', 'B']
+    assert os.path.exists(snapshot_path('Estudantes', '2024', pasta))
+    B = load_snapshot('Estudantes', '2024', pasta_dados=pasta)
+    pd.testing.assert_frame_equal(B.astype(object), A.astype(object))
+
+
+def legacy_remove_single_occurrences(df, n=1):
+    # The former per-cell implementation
+    for column in df.columns:
+        value_counts = df[column].value_counts()
+        to_remove = value_counts[value_counts <= n].index
+        df[column] = df[column].apply(lambda x: x if x not in to_remove else None)
+    return df
+
+
+@pytest.mark.parametrize('n', [1, 2, 5])
+def test_suppression_matches_legacy_on_exports(n):
+    for perfil in PERFIS:
+        for ano in listar_anos(DATA):
+            path = data_path(perfil, ano, DATA)
+            if not os.path.exists(path):
+                continue
+            A = pd.read_csv(path, sep=';', keep_default_na=False)
+            pd.testing.assert_frame_equal(remove_single_occurrences(A, n),
+                                          legacy_remove_single_occurrences(A.copy(), n))
+
+
+@pytest.mark.parametrize('n', [1, 2, 5])
+def test_suppression_matches_legacy_on_mixed_dtypes(n):
+    A = pd.DataFrame({
+        'int': [1, 1, 2, 3, 3, 3],
+        'kept': [5, 5, 5, 6, 6, 6],
+        'float': [1.5, np.nan, 1.5, 2.0, 2.0, 1.5],
+        'text': ['a', 'a', 'b', '', '', 'c'],
+        'mixed': ['a', 1, 1, None, 2, 2],
+        'bool': [True, True, False, None, True, False],
+        'category': pd.Categorical(['x', 'y', 'x', 'x', 'z', 'z']),
+        'date': pd.to_datetime(['2024-01-01'] * 4 + ['2024-01-02', '2024-01-03']),
+    })
+    pd.testing.assert_frame_equal(remove_single_occurrences(A, n),
+                                  legacy_remove_single_occurrences(A.copy(), n))
+
+
+def test_schema_columns_missing_from_the_export_are_blank(pasta):
+    rows = [{'Campus': 'A'}, {'Campus': 'A'}]
+    write_export(pasta, 'Estudantes', '2024', rows, schema={'Campus': 'Campus', '': 'CPA'})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        A = read_csv_survey('Estudantes', '2024', pasta)
+    assert A['CPA'].dtype == object
+    assert list(A['CPA']) == ['', '']
+
+
+def test_spans_of_the_year_workers_are_kept(pasta):
+    # load_years reads the years in a thread pool; a cold load must still
+    # show the ingestion stages under the caller's span
+    rows = [{'Campus': 'A'}, {'Campus': 'A'}, {'Campus': 'B'}, {'Campus': 'B'}]
+    for ano in ('2023', '2024'):
+        write_export(pasta, 'Estudantes', ano, rows)
+    start_run()
+    with span('comparacao'):
+        load_years('Estudantes', ['2023', '2024'], pasta)
+    spans = end_run()
+    stages = [s['stage'] for s in spans if s['depth'] > 0]
+    assert stages.count('csv_load') == 2
+    assert stages.count('suppress') == 2
+    assert spans[0]['stage'] == 'comparacao' and spans[0]['depth'] == 0
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import hashlib
+from itertools import product
+import results
+from conftest import ROOT, write_export
+from filters import FilterIndex
+from ingestion import PERFIS, codebook_path, data_path, filter_columns, listar_anos, load_survey
+from persistence import prune, store_path, stored_result, warm_up
+from results import selection_key
+
+DATA = os.path.join(ROOT, 'data')
+
+
+def test_warm_up_keys_match_the_dashboard(monkeypatch):
+    # Every Resultados selection precomputed by warm_up is one the dashboard
+    # looks up: single values of its two filters (or none), per perfil/year
+    warmed = {}
+    def record(perfil, ano, selection, metric, build, pasta_dados='data', persist=False):
+        if metric[0] != 'comparacao':
+            warmed.setdefault((perfil, ano), set()).add(selection_key(selection))
+    monkeypatch.setattr(results, 'cached_result', record)
+    warm_up(DATA)
+    expected = {}
+    for perfil in PERFIS:
+        for ano in listar_anos(DATA):
+            if not os.path.exists(data_path(perfil, ano, DATA)):
+                continue
+            cols = filter_columns(perfil, ano, DATA)
+            assert 'Unidade' not in cols and 'LOTACAO' not in cols
+            index = FilterIndex(load_survey(perfil, ano, DATA), cols)
+            values = [[None] + [v for v in index.options(c) if v != ''] for c in cols]
+            expected[perfil, ano] = {selection_key({c: [v] for c, v in zip(cols, combo)
+                                                    if v is not None})
+                                     for combo in product(*values)}
+    assert warmed == expected
+
+
+def small_export(pasta):
+    # Only hashed here, so any codebook will do
+    write_export(pasta, 'Estudantes', '2024', [{'Campus': 'A'}, {'Campus': 'A'}])
+    with open(codebook_path('Estudantes', pasta), 'w', encoding='utf-8') as file:
+        file.write('\n')
+
+
+def test_unreadable_result_is_rebuilt(pasta):
+    small_export(pasta)
+    assert stored_result('Estudantes', ['2024'], ('k',), lambda: 1, pasta) == 1
+    # A blob with a valid checksum that does not unpickle
+    blob = b'not a pickle'
+    with sqlite3.connect(store_path(pasta)) as db:
+        db.execute('UPDATE resultados SET valor = ?, sha256 = ?',
+                   (blob, hashlib.sha256(blob).hexdigest()))
+    assert stored_result('Estudantes', ['2024'], ('k',), lambda: 2, pasta) == 2
+    assert stored_result('Estudantes', ['2024'], ('k',), lambda: 3, pasta) == 2
+
+
+def test_prune_keeps_the_hashes_of_this_store(pasta, tmp_path):
+    # Hashes remembered for another data folder must not decide what this
+    # store keeps, and an empty folder prunes without failing
+    empty = str(tmp_path / 'vazia')
+    os.makedirs(empty)
+    assert prune(empty) == 0
+    small_export(pasta)
+    stored_result('Estudantes', ['2024'], ('k',), lambda: 1, pasta)
+    with sqlite3.connect(store_path(pasta)) as db:
+        before = db.execute('SELECT COUNT(*) FROM fontes').fetchone()[0]
+    assert prune(pasta) == 0
+    with sqlite3.connect(store_path(pasta)) as db:
+        assert db.execute('SELECT COUNT(*) FROM fontes').fetchone()[0] == before > 0
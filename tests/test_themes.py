@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import themes
+from results import ResultCache
+from themes import TermMatrix
+
+
+def test_selection_sums_are_kept_under_the_budget(monkeypatch):
+    cache = ResultCache(budget=4096)
+    monkeypatch.setattr(themes, 'RESULTS', cache)
+    texts = [f'restaurante universitario campus {i}' for i in range(40)]
+    facets = pd.DataFrame({'Campus': [f'C{i}' for i in range(40)]})
+    matrix = TermMatrix.build(texts, facets)
+    for i in range(40):
+        assert matrix.top_terms({'Campus': [f'C{i}', f'C{(i + 1) % 40}']})['Respostas'].iloc[0] == 2
+    stats = cache.stats()
+    assert stats['misses'] == 40 and stats['evictions'] > 0
+    assert stats['bytes'] <= stats['budget']
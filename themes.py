@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Recurring themes of the open-ended answers: a sparse document-term matrix
+# (terms and bigrams, Portuguese stopwords removed) built once per profile,
+# from which the most frequent and the most distinctive terms of any
+# Campus / Unidade / year selection are summed without re-tokenizing.
+import numpy as np
+import pandas as pd
+from filters import FilterIndex, suppress_single
+from search import TEXT_FACETS, index_sources, load_index, tokenize
+from ingestion import cached
+from results import RESULTS, data_version, selection_key
+
+
+# Accent-free, as produced by tokenize()
+STOPWORDS = frozenset('''
+a ao aos aquela aquelas aquele aqueles aquilo as ate com como da das de dela delas dele
+deles depois do dos e ela elas ele eles em entre era eram essa essas esse esses esta
+estao estas estava estavam este estes eu foi foram ha isso isto ja la lhe lhes mais mas
+me mesmo meu meus minha minhas muito muita muitas muitos na nao nas nem no nos nossa
+nossas nosso nossos num numa o os ou para pela pelas pelo pelos por qual quando que
+quem se sem ser seu seus so sua suas tambem te tem temos ter um uma umas uns voce voces
+sao seja sejam sendo pois porque pra pro ai assim ainda onde bem cada fazer faz sobre
+todo toda todos todas tudo vez vezes apenas outro outra outros outras alguns algumas
+algum alguma acho acredito deveria deveriam poderia seria sei esta estar estou ne
+alem disso desse dessa deste desta nesse nessa neste nesta tao
+'''.split())
+
+
+def terms(text):
+    # Content words and the bigrams of consecutive content words
+    words = [t for t in tokenize(text) if t not in STOPWORDS and not t.isdigit()]
+    return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+
+class TermMatrix:
+    # Document-term counts in CSR layout: the terms of document i are
+    # terms[indptr[i]:indptr[i+1]], with their counts. Sums over a selection
+    # are kept in the shared results cache (results.RESULTS) under `source`,
+    # which identifies the corpus; a matrix built without one gets its own.
+
+    def __init__(self, facets, vocab, indptr, terms, counts, source=None):
+        self.facets = facets
+        self.vocab = np.array(vocab, dtype=object)
+        self.bigram = np.array([' ' in t for t in vocab], dtype=bool)
+        self.indptr = indptr
+        self.terms = terms
+        self.counts = counts
+        self.filters = FilterIndex(facets, list(facets.columns))
+        self.source = object() if source is None else source
+
+    @classmethod
+    def build(cls, texts, facets, source=None):
+        vocab = {}
+        indptr, ids, counts = [0], [], []
+        for text in texts:
+            t, c = np.unique([vocab.setdefault(w, len(vocab)) for w in terms(text)],
+                             return_counts=True)
+            ids.append(t)
+            counts.append(c)
+            indptr.append(indptr[-1] + len(t))
+        ids = np.concatenate(ids or [np.empty(0)]).astype(np.int32)
+        counts = np.concatenate(counts or [np.empty(0)]).astype(np.int32)
+        return cls(facets.reset_index(drop=True), list(vocab), np.array(indptr), ids, counts,
+                   source)
+
+    def documents(self, selection=None):
+        return self.filters.select(selection or {})
+
+    def sums(self, selection=None):
+        # (answers mentioning each term, answers) for a selection
+        key = selection_key(selection or {})
+        def build():
+            docs = self.documents(dict(key))
+            entries = np.repeat(docs, np.diff(self.indptr))
+            df = np.bincount(self.terms[entries], minlength=len(self.vocab))
+            return df, int(docs.sum())
+        return RESULTS.get(('termos', self.source, key), build)
+
+    def top_terms(self, selection=None, k=15, bigrams=False):
+        df, n = self.sums(selection)
+        df = np.where((self.bigram == bigrams) & (suppress_single(n) > 0), df, 0)
+        top = np.argsort(-df, kind='stable')[:k]
+        top = top[df[top] > 0]
+        return pd.DataFrame({'Termo': self.vocab[top], 'Respostas': df[top],
+                             'Respostas (%)': (df[top] / max(n, 1) * 100).round(1)})
+
+    def distinctive(self, selection, k=15, prior=100):
+        # Terms over-represented in the selection against the other answers:
+        # log-odds ratio with an informative Dirichlet prior (the whole
+        # corpus), as a z-score (Monroe, Colaresi & Quinn, 2008)
+        df, n = self.sums(selection)
+        total, n_total = self.sums()
+        rest, n_rest = total - df, n_total - n
+        alpha = prior * (total + 0.01) / (total + 0.01).sum()
+        a0 = alpha.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = (np.log((df + alpha) / (n + a0 - df - alpha))
+                     - np.log((rest + alpha) / (n_rest + a0 - rest - alpha)))
+            z = delta / np.sqrt(1 / (df + alpha) + 1 / (rest + alpha))
+        z = np.where(df > 1, z, -np.inf)
+        top = np.argsort(-z, kind='stable')[:k]
+        top = top[np.isfinite(z[top]) & (z[top] > 0)]
+        return pd.DataFrame({'Termo': self.vocab[top], 'Respostas': df[top],
+                             'z': z[top].round(2)})
+
+    def compare(self, facet, k=10, min_answers=5, within=None):
+        # Distinctive terms of every value of `facet` (one column per value
+        # with at least `min_answers` answers), optionally within a selection
+        within = {c: v for c, v in (within or {}).items() if c != facet}
+        columns = {}
+        for value in self.filters.options(facet):
+            selection = {**within, facet: [value]}
+            if value == '' or self.sums(selection)[1] < min_answers:
+                continue
+            columns[value] = pd.Series(self.distinctive(selection, k)['Termo'].values)
+        return pd.DataFrame(columns)
+
+
+def load_terms(perfil, pasta_dados='data'):
+    # Built from the search index corpus once per process and profile
+    anos, sources = index_sources(perfil, pasta_dados)
+    def build(path):
+        index = load_index(perfil, pasta_dados)
+        return TermMatrix.build(index.texts, index.facets[[c for c in TEXT_FACETS
+                                                           if c in index.facets.columns]],
+                                (perfil, data_version(perfil, anos, pasta_dados)))
+    return cached(f'termos-{perfil}', sources[0], build, depends=tuple(sources[1:]))